@@ -1,19 +1,33 @@
 import streamlit as st
 import google.generativeai as genai
-from PIL import Image
+from google.ai import generativelanguage as glm
+from google.generativeai import client as genai_client
+from PIL import Image, ImageOps
 from fpdf import FPDF
+import pypdfium2 as pdfium
+from google.api_core import exceptions as gexc
+from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date
+import hashlib
 import io
-
-# --- SAYFA AYARLARI ---
-st.set_page_config(
-    page_title="Mühendislik Asistanı",
-    page_icon="📐",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+import json
+import math
+import mimetypes
+import mmap
+import os
+import queue
+import random
+import re
+import sqlite3
+import sys
+import threading
+import time
 
 # --- CSS (DÜZELTİLMİŞ SOLA DAYALI MENÜ & TEMA) ---
-st.markdown("""
+CSS = """
     <style>
     .block-container {
         padding-top: 4rem !important;
@@ -118,53 +132,1959 @@ st.markdown("""
     .stButton>button { border-radius: 8px; font-weight: 600; border: 1px solid #444; }
     .stTextInput input { color: white !important; }
     </style>
-    """, unsafe_allow_html=True)
+    """
 
 # --- PDF MOTORU ---
+# Unicode TTF bulunursa Türkçe karakterler olduğu gibi basılır. Bulunamazsa çekirdek
+# fonta düşülür ve tek geçişlik translate tablosu kullanılır (içerik atılmaz, '?' olur).
+PDF_FONT_ADAYLARI = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:/Windows/Fonts/arial.ttf",
+]
+_TR_ASCII = str.maketrans({'ğ': 'g', 'Ğ': 'G', 'ş': 's', 'Ş': 'S', 'ı': 'i', 'İ': 'I', 'ü': 'u', 'Ü': 'U', 'ö': 'o', 'Ö': 'O', 'ç': 'c', 'Ç': 'C', 'â': 'a'})
+
+def pdf_font_yolu():
+    yol = ayar("PDF_FONT")
+    if yol: return yol if os.path.exists(yol) else None
+    return next((y for y in PDF_FONT_ADAYLARI if os.path.exists(y)), None)
+
 class PDF(FPDF):
+    def __init__(self, font_path=None):
+        super().__init__()
+        self.unicode = bool(font_path)
+        if font_path: self.add_font("Govde", "", font_path)
+        self.govde = "Govde" if font_path else "Helvetica"
+
+    def metin(self, s):
+        if self.unicode: return s
+        return s.translate(_TR_ASCII).encode("latin-1", "replace").decode("latin-1")
+
     def header(self):
-        self.set_font('Arial', 'B', 12)
-        self.cell(0, 10, 'Muhendislik Asistani Raporu', 0, 1, 'C')
+        self.set_font(self.govde, "" if self.unicode else "B", 12)
+        self.cell(0, 10, self.metin("Mühendislik Asistanı Raporu"), align="C", new_x="LMARGIN", new_y="NEXT")
         self.ln(5)
 
-def create_pdf(text):
-    pdf = PDF()
+def _render_pdf(text):
+    pdf = PDF(pdf_font_yolu())
     pdf.add_page()
-    pdf.set_font("Arial", size=11)
-    replacements = {'ğ': 'g', 'Ğ': 'G', 'ş': 's', 'Ş': 'S', 'ı': 'i', 'İ': 'I', 'ü': 'u', 'Ü': 'U', 'ö': 'o', 'Ö': 'O', 'ç': 'c', 'Ç': 'C', 'â': 'a'}
-    clean_text = text
-    for src, target in replacements.items():
-        clean_text = clean_text.replace(src, target)
-    pdf.multi_cell(0, 10, clean_text)
-    return pdf.output(dest="S").encode("latin-1", "ignore")
+    pdf.set_font(pdf.govde, size=11)
+    # Satıra sığanlar cell ile basılır; multi_cell'in satır kırma maliyeti yalnızca uzun satırlarda ödenir
+    for satir in pdf.metin(text).split("\n"):
+        if pdf.get_string_width(satir) <= pdf.epw: pdf.cell(0, 10, satir, new_x="LMARGIN", new_y="NEXT")
+        else: pdf.multi_cell(0, 10, satir, new_x="LMARGIN", new_y="NEXT")
+    return bytes(pdf.output())
+
+# Üretilen PDF'ler içerik özetiyle, toplam bayt sınırlı LRU'da tutulur (oturumlar arası ortak)
+class BytesLRU:
+    def __init__(self, limit_bytes):
+        self.limit = limit_bytes
+        self.size = 0
+        self._od = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._od: return None
+            self._od.move_to_end(key)
+            return self._od[key]
+
+    def put(self, key, data):
+        with self._lock:
+            if key in self._od: self.size -= len(self._od.pop(key))
+            self._od[key] = data
+            self.size += len(data)
+            while self.size > self.limit and len(self._od) > 1:
+                self.size -= len(self._od.popitem(last=False)[1])
+
+@st.cache_resource(show_spinner=False)
+def pdf_onbellegi():
+    return BytesLRU(int(ayar("PDF_ONBELLEK_MB")) * 1024 * 1024)
+
+def create_pdf(text):
+    anahtar = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    onbellek = pdf_onbellegi()
+    pdf = onbellek.get(anahtar)
+    if pdf is None:
+        with olcum("pdf", karakter=len(text)) as kayit:
+            pdf = _render_pdf(text)
+            kayit["bayt"] = len(pdf)
+        onbellek.put(anahtar, pdf)
+    return pdf
+
+# Büyüyen formül defteri sabit boyutlu bloklar halinde basılır; yeni formül eklenince
+# yalnızca son blok yeniden üretilir, diğerleri önbellekten gelip pdfium ile birleştirilir.
+def create_notebook_pdf(items, block=500):
+    bloklar = [create_pdf("\n".join(items[i:i + block])) for i in range(0, len(items), block)] or [create_pdf("")]
+    if len(bloklar) == 1: return bloklar[0]
+    anahtar = hashlib.sha256(b"".join(hashlib.sha256(b).digest() for b in bloklar)).hexdigest()
+    onbellek = pdf_onbellegi()
+    pdf = onbellek.get(anahtar)
+    if pdf is None:
+        with olcum("pdf_birlestir", blok=len(bloklar)), _pdfium_kilit:
+            hedef = pdfium.PdfDocument.new()
+            for b in bloklar: hedef.import_pages(pdfium.PdfDocument(b))
+            buf = io.BytesIO()
+            hedef.save(buf)
+        pdf = buf.getvalue()
+        onbellek.put(anahtar, pdf)
+    return pdf
+
+# İndirme butonu: PDF yalnızca tıklanınca üretilir, yeniden çalıştırmada değil
+def pdf_indir(etiket, uretici, dosya_adi, key=None):
+    st.download_button(etiket, uretici, dosya_adi, "application/pdf", key=key, on_click="ignore")
+
+# --- AYARLAR ---
+# Ortam değişkeni > secrets.toml > varsayılan sırasıyla okunur.
+VARSAYILAN_AYARLAR = {
+    "GEMINI_API_KEY": None,
+    "MODEL_ADI": "gemini-2.0-flash",
+    "MODEL_ARKA_UC": "gemini",          # "gemini" veya ağ gerektirmeyen "yerel" test modeli
+    "YEREL_GECIKME_SN": 0.5,
+    "YEREL_ILK_TOKEN_SN": 0.1,
+    "YEREL_HATA_ORANI": 0.0,            # yerel modelde rastgele 429/500/503 oranı (0-1)
+    "YEREL_YAVAS_ORANI": 0.0,           # yerel modelde yavaş kuyruk oranı (0-1)
+    "YEREL_YAVAS_KAT": 10.0,
+    "MODEL_YEDEKLERI": "gemini-2.0-flash-lite,gemini-1.5-flash",  # sırayla denenecek yedek modeller
+    "CAGRI_SURE_SN": 60.0,              # denemenin ilk yanıtı (akışta parçalar arası) için üst sınır
+    "CAGRI_DENEME": 3,                  # model başına deneme; geçici hatalarda tekrar edilir
+    "CAGRI_BEKLEME_SN": 1.0,            # üstel bekleme tabanı (rastgele: 0..taban*2^n)
+    "HEDGE_YUZDELIK": 95,               # ilk yanıt bu yüzdeliği aşınca ikinci deneme; 0: kapalı
+    "HEDGE_MIN_ORNEK": 20,              # yüzdelik için gereken en az gecikme örneği
+    "DEVRE_ESIK": 5,                    # üst üste bu kadar geçici hatada model devre dışı
+    "DEVRE_SURE_SN": 30.0,
+    "CAGRI_ISCI": 64,                   # tüm anahtarların denemelerini (hedge dahil) yürüten ortak havuz
+    "GORSEL_MAKS_KENAR": 1600,          # belge fotoğrafları için en uzun kenar (px)
+    "CIZIM_MAKS_KENAR": 2048,           # teknik resimlerde ince detay kaybolmasın
+    "GORSEL_JPEG_KALITE": 85,
+    "GORSEL_IKILI": False,              # belge fotoğraflarını siyah-beyaza indir
+    "SOHBET_TOKEN_BUTCESI": 4000,       # bu aşılınca eski turlar özetlenir
+    "SOHBET_SON_TUR": 6,                # özetlenmeden aynen tutulan son mesaj sayısı (çift)
+    "PDF_FONT": "",                     # boşsa sistemde bilinen Unicode fontlar aranır
+    "PDF_ONBELLEK_MB": 64,
+    "EK_DISK_MB": 2048,                 # yüklenen dosyaların diskteki ortak deposu
+    "EK_BELLEK_MB": 256,                # depodan aynı anda bellek eşlemeli açık tutulan toplam
+    "SAYFA_BOYUTU": 20,                 # ders görünümünde sayfa başına kayıt
+    "IS_ISCI": 8,                       # arka plan işlerinde aynı anda açık model çağrısı
+    "IS_SAKLAMA_SN": 900,               # biten işin sonucu en az bu kadar alınabilir kalır
+    "ALT_ISCI": 8,                      # tam rapor gibi bir işin içinden aynı anda açılan çağrı
+    "DAKIKA_ISTEK_LIMITI": 60,
+    "TOPLU_ISCI": 4,                    # toplu çözüm/defter ayrı havuzda; etkileşimli işler arkalarında beklemez
+    "TOPLU_KOTA_ORANI": 0.5,            # dakikalık istek sınırının toplu işlere ayrılan en fazla payı
+    "VERI_DIZINI": os.path.join(os.path.dirname(os.path.abspath(__file__)), ".veri"),
+    "ONBELLEK_BELLEK_KAYIT": 256,
+    "ONBELLEK_DISK_KAYIT": 5000,
+    "ONBELLEK_SURE_SN": 7 * 24 * 3600,
+    "OLCUM_KAYIT": 5000,                # tanılama panelinde tutulan son ölçüm sayısı
+    "SINAV_BAGLAM_TOKEN": 1200,         # örnek sınav isteğine eklenen ders kayıtlarının bütçesi
+    "SINAV_ADAY": 200,                  # bağlam seçiminde değerlendirilen en fazla kayıt
+    "SINAV_MMR_LAMBDA": 0.7,            # 1'e yakın: ilgi, 0'a yakın: çeşitlilik
+}
+
+# Ortam değişkeni hep metindir; secrets TOML'da tipli ya da tırnaklı ("false") olabilir, ikisi aynı okunur
+def _ayar_degeri(varsayilan, deger):
+    # bool, int'in alt sınıfıdır; bool("0") True olacağından ayrıca okunur
+    if isinstance(varsayilan, bool):
+        return deger if isinstance(deger, bool) else str(deger).strip().lower() in ("1", "true", "evet", "yes", "on")
+    return type(varsayilan)(deger) if isinstance(varsayilan, (int, float)) else deger
+
+def ayar(anahtar):
+    varsayilan = VARSAYILAN_AYARLAR[anahtar]
+    if anahtar in os.environ: return _ayar_degeri(varsayilan, os.environ[anahtar])
+    try:
+        if anahtar in st.secrets: return _ayar_degeri(varsayilan, st.secrets[anahtar])
+    except FileNotFoundError:
+        pass
+    return varsayilan
 
 # --- API ANAHTARI ---
-api_key = None
-if "GEMINI_API_KEY" in st.secrets:
-    api_key = st.secrets["GEMINI_API_KEY"]
-else:
-    pass
+api_key = ayar("GEMINI_API_KEY")
 
-# --- MODEL FONKSİYONU ---
-def get_gemini_response(inputs):
-    if not api_key: return "Hata: API Anahtarı Eksik."
+# --- YANIT ÖNBELLEĞİ ---
+# Prompt metni + eklerin içeriğinden kararlı SHA-256 anahtarı.
+# Çok turlu içerikler ({"role", "parts"}) ve dosya referansları da özyinelemeli özetlenir.
+def _hash_part(h, part):
+    if isinstance(part, str):
+        h.update(b"txt\0" + part.encode("utf-8"))
+    elif isinstance(part, Image.Image):
+        # Aynı piksel verisi farklı dosya nesnelerinden gelse de aynı anahtarı versin
+        img = part if part.mode in ("RGB", "L") else part.convert("RGB")
+        h.update(f"img\0{img.mode}\0{img.size[0]}x{img.size[1]}\0".encode())
+        h.update(img.tobytes())
+    elif isinstance(part, dict) and "data" in part:
+        h.update(f"blob\0{part.get('mime_type', '')}\0".encode())
+        h.update(bytes(part["data"]))
+    elif isinstance(part, dict):
+        for k in sorted(part):
+            h.update(f"key\0{k}\0".encode())
+            _hash_part(h, part[k])
+    elif isinstance(part, (list, tuple)):
+        h.update(b"list\0")
+        for p in part: _hash_part(h, p)
+    else:
+        h.update(b"obj\0" + repr(part).encode("utf-8"))
+    h.update(b"\1")
+
+def content_hash(inputs):
+    h = hashlib.sha256()
+    for part in inputs: _hash_part(h, part)
+    return h.hexdigest()
+
+# Bellek içi LRU (oturumlar arası ortak) + SQLite disk katmanı (yeniden başlatmada da kalır).
+# Süresi dolan kayıtlar okunurken düşer; disk katmanı limiti aşınca en eski erişilenler silinir.
+class ResponseCache:
+    def __init__(self, path, mem_limit=256, disk_limit=5000, ttl=7 * 24 * 3600):
+        self.mem_limit = mem_limit
+        self.disk_limit = disk_limit
+        self.ttl = ttl
+        self.stats = {"bellek_isabet": 0, "disk_isabet": 0, "iska": 0}
+        self._mem = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS yanitlar ("
+            "anahtar TEXT PRIMARY KEY, yanit TEXT NOT NULL, "
+            "olusturma REAL NOT NULL, erisim REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._mem.get(key)
+            if entry is not None:
+                text, created = entry
+                if now - created <= self.ttl:
+                    self._mem.move_to_end(key)
+                    self.stats["bellek_isabet"] += 1
+                    return text
+                del self._mem[key]
+            row = self._db.execute(
+                "SELECT yanit, olusturma FROM yanitlar WHERE anahtar = ?", (key,)
+            ).fetchone()
+            if row is not None and now - row[1] <= self.ttl:
+                self._db.execute("UPDATE yanitlar SET erisim = ? WHERE anahtar = ?", (now, key))
+                self._db.commit()
+                self._remember(key, row[0], row[1])
+                self.stats["disk_isabet"] += 1
+                return row[0]
+            if row is not None:
+                self._db.execute("DELETE FROM yanitlar WHERE anahtar = ?", (key,))
+                self._db.commit()
+            self.stats["iska"] += 1
+            return None
+
+    def put(self, key, text):
+        now = time.time()
+        with self._lock:
+            self._remember(key, text, now)
+            self._db.execute(
+                "INSERT OR REPLACE INTO yanitlar VALUES (?, ?, ?, ?)", (key, text, now, now)
+            )
+            self._db.execute(
+                "DELETE FROM yanitlar WHERE olusturma < ? OR anahtar IN ("
+                "SELECT anahtar FROM yanitlar ORDER BY erisim DESC LIMIT -1 OFFSET ?)",
+                (now - self.ttl, self.disk_limit),
+            )
+            self._db.commit()
+
+    def _remember(self, key, text, created):
+        self._mem[key] = (text, created)
+        self._mem.move_to_end(key)
+        while len(self._mem) > self.mem_limit:
+            self._mem.popitem(last=False)
+
+@st.cache_resource(show_spinner=False)
+def yanit_onbellegi():
+    return ResponseCache(
+        os.path.join(ayar("VERI_DIZINI"), "yanit_onbellegi.sqlite3"),
+        mem_limit=int(ayar("ONBELLEK_BELLEK_KAYIT")),
+        disk_limit=int(ayar("ONBELLEK_DISK_KAYIT")),
+        ttl=float(ayar("ONBELLEK_SURE_SN")),
+    )
+
+# --- GECİKME KAYDI ---
+# Akışlı çağrılarda ilk token süresi (ttft), tüm çağrılarda toplam süre tutulur
+@st.cache_resource(show_spinner=False)
+def gecikme_kaydi():
+    return deque(maxlen=500)
+
+def gecikme_ozeti():
+    kayit = list(gecikme_kaydi())
+    def medyan(degerler):
+        degerler = sorted(degerler)
+        return degerler[len(degerler) // 2] if degerler else None
+    return {
+        "ttft": medyan([k["ttft"] for k in kayit if k["tur"] == "akis" and k["ttft"] is not None]),
+        "akis_toplam": medyan([k["toplam"] for k in kayit if k["tur"] == "akis"]),
+        "tam_toplam": medyan([k["toplam"] for k in kayit if k["tur"] == "tam"]),
+    }
+
+# --- ÖLÇÜM ---
+# Her yeniden çalıştırma ve içindeki ağır adımlar (sayfa fonksiyonu, görsel çözme, PDF üretimi,
+# model çağrısı) süre kaydı olarak süreç genelindeki halka tampona yazılır. Kayıtlar ait oldukları
+# çalıştırmanın kimliğini taşır; model çağrıları token, bayt ve hata sınıfı da ekler.
+_olcum_yerel = threading.local()
+
+@st.cache_resource(show_spinner=False)
+def olcum_kaydi():
+    return deque(maxlen=int(ayar("OLCUM_KAYIT")))
+
+def aktif_calistirma():
+    return getattr(_olcum_yerel, "calistirma", None)
+
+@contextmanager
+def olcum(ad, **alanlar):
+    kayit = {"ad": ad, "calistirma": aktif_calistirma(), "zaman": round(time.time(), 3), **alanlar}
+    baslangic = time.perf_counter()
     try:
-        genai.configure(api_key=api_key)
-        model = genai.GenerativeModel('gemini-2.0-flash')
-        if not isinstance(inputs, list): inputs = [inputs]
-        response = model.generate_content(inputs)
-        return response.text
+        yield kayit
     except Exception as e:
-        return f"Sistem Hatası: {e}"
+        kayit["hata"] = type(e).__name__
+        raise
+    finally:
+        kayit["sure_ms"] = round((time.perf_counter() - baslangic) * 1000, 2)
+        olcum_kaydi().append(kayit)
+
+def yuzdelik(degerler, p):
+    degerler = sorted(degerler)
+    if not degerler: return None
+    return degerler[min(len(degerler) - 1, int(len(degerler) * p / 100))]
+
+def olcum_ozeti():
+    gruplar = {}
+    for k in list(olcum_kaydi()): gruplar.setdefault(k["ad"], []).append(k)
+    satirlar = []
+    for ad, kayitlar in sorted(gruplar.items()):
+        sureler = [k["sure_ms"] for k in kayitlar]
+        satirlar.append({
+            "ad": ad, "adet": len(kayitlar),
+            "p50 ms": yuzdelik(sureler, 50), "p90 ms": yuzdelik(sureler, 90), "p99 ms": yuzdelik(sureler, 99),
+            "hata": sum(1 for k in kayitlar if k.get("hata")),
+        })
+    return satirlar
+
+def olcum_jsonl():
+    return "".join(json.dumps(k, ensure_ascii=False) + "\n" for k in list(olcum_kaydi())).encode("utf-8")
+
+def tanilama_paneli():
+    # Bellek: oturum yalnızca referans tutar, ek baytları süreç genelindeki depoda paylaşılır
+    ekler, depo = oturum_ekleri(), ek_deposu().stats()
+    st.caption(f"Bu oturum: durum ≈{oturum_bellegi() / 1024:.0f} KB · {len(ekler)} ek ({sum(ekler.values()) / 2**20:.1f} MB, depoda paylaşılan)")
+    st.caption(f"Ek deposu: {depo['dosya']} dosya · disk {depo['disk'] / 2**20:.1f}/{ayar('EK_DISK_MB')} MB · "
+               f"eşlenen {depo['eslenen'] / 2**20:.1f}/{ayar('EK_BELLEK_MB')} MB")
+    kayitlar = list(olcum_kaydi())
+    if not kayitlar:
+        st.caption("Henüz ölçüm yok.")
+        return
+    st.dataframe(olcum_ozeti(), hide_index=True)
+    model = [k for k in kayitlar if k["ad"] == "model"]
+    if model:
+        st.caption(f"Model: {sum(k.get('giris_token', 0) for k in model)} giriş / {sum(k.get('cikis_token', 0) for k in model)} çıkış token · "
+                   f"{sum(k.get('giris_bayt', 0) for k in model) / 1024:.0f} KB gönderildi · "
+                   f"{sum(1 for k in model if k.get('onbellek'))} önbellekten")
+    hatalar = {}
+    for k in kayitlar:
+        if k.get("hata"): hatalar[k["hata"]] = hatalar.get(k["hata"], 0) + 1
+    if hatalar: st.caption("Hatalar: " + ", ".join(f"{ad} ×{n}" for ad, n in sorted(hatalar.items(), key=lambda x: -x[1])))
+    # Son tamamlanan çalıştırmanın dökümü
+    son = next((k["calistirma"] for k in reversed(kayitlar) if k["ad"] == "calistirma"), None)
+    if son:
+        st.caption("Son çalıştırma: " + " · ".join(f"{k['ad']} {k['sure_ms']:.0f} ms" for k in kayitlar if k["calistirma"] == son))
+    st.download_button("Ölçümleri JSONL İndir", olcum_jsonl, "olcum.jsonl", "application/x-ndjson", on_click="ignore")
+
+# --- MODEL ARKA UÇLARI ---
+# inputs ya düz bir parça listesi ya da çok turlu [{"role": "user"/"model", "parts": [...]}] listesidir.
+# usage sözlüğü verilirse çağrı bitince giriş/çıkış token sayılarıyla doldurulur.
+# timeout verilirse arka uç bu süreden sonra isteği kendisi keser (saniye).
+class ModelBackend(ABC):
+    name = "temel"
+    needs_api_key = True
+
+    @abstractmethod
+    def generate(self, inputs, model_name, usage=None, timeout=None): ...
+
+    @abstractmethod
+    def stream(self, inputs, model_name, usage=None): ...
+
+    # Büyük ekleri bir kez yükleyip sonraki turlarda referansla gönderir; varsayılan satır içi
+    def upload(self, data, mime_type):
+        return {"mime_type": mime_type, "data": data}
+
+def _chunk_text(chunk):
+    # Son parça yalnızca bitiş bilgisi taşıyabilir, .text o zaman ValueError atar
+    try: return chunk.text
+    except ValueError: return ""
+
+def _leaf_parts(inputs):
+    for p in inputs:
+        if isinstance(p, dict) and "parts" in p: yield from p["parts"]
+        else: yield p
+
+def estimate_tokens(metin):
+    # Kaba tahmin: Türkçe metinde ~4 karakter/token
+    return len(metin) // 4 + 1
+
+# GenerativeModel'e kendi istemcisini vermenin genel bir yolu yok; özel _client alanı yalnızca
+# burada atanır. requirements.txt'te sabitlenen google-generativeai==0.8.6 ile doğrulandı; paket
+# artık güncellenmediğinden alan değişmez, ama sürüm yükseltilirse önce bu yardımcı kontrol edilmeli.
+def _istemcili_model(model_name, client):
+    model = genai.GenerativeModel(model_name)
+    if not hasattr(model, "_client"): raise RuntimeError("google-generativeai sürümü beklenenden farklı: GenerativeModel._client yok")
+    model._client = client
+    return model
+
+# Anahtar başına tek istemci; genai.configure süreç genelinde olduğundan
+# her model kendi istemcisini kullanır, farklı anahtarlı oturumlar karışmaz.
+class GeminiBackend(ModelBackend):
+    name = "gemini"
+
+    def __init__(self, api_key):
+        self._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+        self._files = genai_client.FileServiceClient(client_options={"api_key": api_key})
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def model(self, model_name):
+        with self._lock:
+            if model_name not in self._models: self._models[model_name] = _istemcili_model(model_name, self._client)
+            return self._models[model_name]
+
+    @staticmethod
+    def _usage(response, usage):
+        if usage is None: return
+        um = response.usage_metadata
+        usage.update(giris=um.prompt_token_count, cikis=um.candidates_token_count)
+
+    def generate(self, inputs, model_name, usage=None, timeout=None):
+        response = self.model(model_name).generate_content(ek_cozumle(inputs), request_options={"timeout": timeout} if timeout else None)
+        self._usage(response, usage)
+        return response.text
+
+    def stream(self, inputs, model_name, usage=None):
+        response = self.model(model_name).generate_content(ek_cozumle(inputs), stream=True)
+        for chunk in response:
+            metin = _chunk_text(chunk)
+            if metin: yield metin
+        self._usage(response, usage)
+
+    def upload(self, data, mime_type):
+        f = self._files.create_file(path=io.BytesIO(data), mime_type=mime_type)
+        return {"file_data": {"mime_type": f.mime_type, "file_uri": f.uri}}
+
+# Ağ gerektirmeyen, aynı girdiye hep aynı yanıtı veren test modeli.
+# Gecikmeler ayarlanabilir; ölçüm ve testler internetsiz makinede çalışsın diye.
+# fault_rate oranında Gemini'nin geçici hatalarını (429/500/503) atar, slow_rate oranında
+# gecikmeyi slow_factor katına çıkarır; dayanıklı çağrı katmanı bununla denenir.
+class LocalBackend(ModelBackend):
+    name = "yerel"
+    needs_api_key = False
+
+    def __init__(self, latency=0.5, first_token=0.1, chunks=8, fault_rate=0.0, slow_rate=0.0, slow_factor=10.0):
+        self.latency = latency
+        self.first_token = min(first_token, latency)
+        self.chunks = chunks
+        self.fault_rate = fault_rate
+        self.slow_rate = slow_rate
+        self.slow_factor = slow_factor
+
+    def _ariza(self):
+        zar = random.random()
+        if zar < self.fault_rate:
+            time.sleep(self.first_token)
+            raise random.choice([
+                gexc.TooManyRequests("429 yerel: istek sınırı aşıldı"),
+                gexc.InternalServerError("500 yerel: iç hata"),
+                gexc.ServiceUnavailable("503 yerel: servis geçici olarak kullanılamıyor"),
+            ])
+        return self.slow_factor if zar < self.fault_rate + self.slow_rate else 1.0
+
+    def reply(self, inputs):
+        ozet = content_hash(inputs)[:12]
+        kullanici = [p for p in inputs if isinstance(p, dict) and p.get("role") == "user"]
+        kaynak = kullanici[-1]["parts"] if kullanici else inputs
+        istek = next((p for p in kaynak if isinstance(p, str)), "").replace(FORMUL_AYRACI, "").strip()
+        ekler = sum(1 for p in _leaf_parts(inputs) if not isinstance(p, str))
+        return (
+            f"**Yerel model yanıtı** ({ozet})\n\n"
+            f"İstek: {' '.join(istek.split())[:200]}\n\n"
+            f"Ek sayısı: {ekler}\n\n"
+            "1. Verilenler yazıldı.\n2. Denge denklemleri kuruldu.\n3. Sonuç bulundu.\n"
+            f"{FORMUL_AYRACI}\nF = m * a\nsigma = F / A"
+        )
+
+    def _usage(self, inputs, metin, usage):
+        if usage is None: return
+        giris = sum(estimate_tokens(p) if isinstance(p, str) else 258 for p in _leaf_parts(inputs))
+        usage.update(giris=giris, cikis=estimate_tokens(metin))
+
+    def generate(self, inputs, model_name, usage=None, timeout=None):
+        gecikme = self.latency * self._ariza()
+        if timeout is not None and gecikme > timeout:
+            time.sleep(timeout)
+            raise gexc.DeadlineExceeded("504 yerel: süre aşıldı")
+        time.sleep(gecikme)
+        metin = self.reply(inputs)
+        self._usage(inputs, metin, usage)
+        return metin
+
+    def stream(self, inputs, model_name, usage=None):
+        kat = self._ariza()
+        metin = self.reply(inputs)
+        boy = -(-len(metin) // self.chunks)
+        kalan_sure = (self.latency - self.first_token) / max(self.chunks - 1, 1)
+        time.sleep(self.first_token * kat)
+        for i in range(0, len(metin), boy):
+            if i: time.sleep(kalan_sure)
+            yield metin[i:i + boy]
+        self._usage(inputs, metin, usage)
+
+    def upload(self, data, mime_type):
+        return {"file_data": {"mime_type": mime_type, "file_uri": "yerel://" + hashlib.sha256(data).hexdigest()[:16]}}
+
+# Süreç genelinde tek kayıt: arka uç ve modelleri (tür, anahtar, model) başına bir kez kurulur.
+# Kenar çubuğuna yazılan her anahtar (yanlışları dahil) bir gRPC istemcisi açar; sayı sınırlıdır.
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_backend(tur, api_key):
+    if tur == "yerel":
+        return LocalBackend(float(ayar("YEREL_GECIKME_SN")), float(ayar("YEREL_ILK_TOKEN_SN")),
+                            fault_rate=float(ayar("YEREL_HATA_ORANI")), slow_rate=float(ayar("YEREL_YAVAS_ORANI")),
+                            slow_factor=float(ayar("YEREL_YAVAS_KAT")))
+    return GeminiBackend(api_key)
+
+def aktif_backend():
+    tur = ayar("MODEL_ARKA_UC")
+    return get_backend(tur, api_key if tur != "yerel" else None)
+
+def model_hazir():
+    return ayar("MODEL_ARKA_UC") == "yerel" or bool(api_key)
+
+# --- DAYANIKLI ÇAĞRI KATMANI ---
+# Model fonksiyonları arka uca doğrudan değil bu katman üzerinden gider:
+# - her denemenin ilk yanıtı (akışta parçalar arası da) CAGRI_SURE_SN ile sınırlıdır,
+# - hatalar sınıflanır: geçici/kota hataları üstel ve rastgele beklemeyle yeniden denenir,
+#   kalıcı hatalar hemen döner, model bulunamazsa sıradaki yedek modele geçilir,
+# - üst üste geçici hata veren modelin devresi açılır; bir süre denenmez, yedeğe düşülür,
+# - ilk yanıt, o modelin geçmiş gecikmelerinin yüksek yüzdeliğini aşarsa ikinci bir deneme
+#   (hedge) başlatılır; hangisi önce yanıt verirse o kullanılır, diğeri bırakılır,
+# - yeniden denemeler ve hedge dahil her deneme, başlamadan önce istek sınırlayıcıdan jeton alır.
+class CallTimeout(TimeoutError):
+    pass
+
+class CircuitOpen(Exception):
+    pass
+
+def classify_error(e):
+    if isinstance(e, gexc.TooManyRequests): return "kota"
+    if isinstance(e, (gexc.ServerError, TimeoutError, ConnectionError)): return "gecici"
+    if isinstance(e, gexc.NotFound): return "model"
+    if isinstance(e, CircuitOpen): return "devre"
+    return "kalici"
+
+class CircuitBreaker:
+    def __init__(self, threshold=5, cooldown=30.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self._failures = 0
+        self._opened = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    # Açık devre süre dolunca yarı açılır: tek bir deneme geçer, sonucu devreyi kapatır ya da yeniden açar
+    def allow(self):
+        with self._lock:
+            if self._opened is None: return True
+            if time.monotonic() - self._opened < self.cooldown or self._trial: return False
+            self._trial = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self._failures, self._opened, self._trial = 0, None, False
+
+    def failure(self):
+        with self._lock:
+            self._trial = False
+            self._failures += 1
+            if self._failures >= self.threshold: self._opened = time.monotonic()
+
+    @property
+    def state(self):
+        if self._opened is None: return "kapali"
+        return "yarim" if time.monotonic() - self._opened >= self.cooldown else "acik"
+
+# Model başına devre ve gecikme geçmişi; çağrı nesnesinden ayrı tutulur ki önbellekten düşen ya da
+# başka anahtarla yeniden kurulan çağrı nesnesi açık devreleri ve hedge eşiklerini sıfırlamasın
+class CallerState:
+    def __init__(self):
+        self.breakers = {}
+        self.latency = {}
+        self.lock = threading.Lock()
+
+class ResilientCaller:
+    def __init__(self, backend, chain, deadline=60.0, attempts=3, backoff=1.0, max_backoff=8.0,
+                 hedge_percentile=95, hedge_min_samples=20, breaker_threshold=5, breaker_cooldown=30.0, workers=32,
+                 limiter=None, state=None, pool=None):
+        self.backend = backend
+        self.limiter = limiter
+        self.chain = list(chain)
+        self.deadline = deadline
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._breaker_args = (breaker_threshold, breaker_cooldown)
+        self._durum = state if state is not None else CallerState()
+        self._pool = pool if pool is not None else ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cagri")
+
+    def breaker(self, model):
+        with self._durum.lock:
+            return self._durum.breakers.setdefault(model, CircuitBreaker(*self._breaker_args))
+
+    def _gecikmeler(self, model, akis):
+        with self._durum.lock:
+            return self._durum.latency.setdefault((model, akis), deque(maxlen=200))
+
+    def hedge_threshold(self, model, akis):
+        ornekler = list(self._gecikmeler(model, akis))
+        if self.hedge_percentile <= 0 or len(ornekler) < self.hedge_min_samples: return None
+        return yuzdelik(ornekler, self.hedge_percentile)
+
+    def _bekleme(self, deneme, sinif):
+        ust = min(self.backoff * 2 ** deneme * (2 if sinif == "kota" else 1), self.max_backoff)
+        return random.uniform(0, ust)
+
+    def _deneme(self, kuyruk, no, model, inputs, akis, iptal):
+        usage = {}
+        try:
+            if akis:
+                for parca in self.backend.stream(inputs, model, usage):
+                    if iptal.is_set(): return
+                    kuyruk.put((no, "parca", parca))
+            else:
+                kuyruk.put((no, "parca", self.backend.generate(inputs, model, usage, timeout=self.deadline)))
+            kuyruk.put((no, "bitti", usage))
+        except Exception as e:
+            kuyruk.put((no, "hata", e))
+
+    # Tek model için bir deneme (gerekirse hedge ile iki); ilk olay gelen deneme kazanır
+    def _calistir(self, model, inputs, akis, usage):
+        kuyruk = queue.Queue()
+        iptaller = []
+        def baslat():
+            # Jeton beklemesi denemenin süre sınırına sayılmaz
+            if self.limiter is not None: self.limiter.wait()
+            iptaller.append(threading.Event())
+            self._pool.submit(self._deneme, kuyruk, len(iptaller) - 1, model, inputs, akis, iptaller[-1])
+        esik = self.hedge_threshold(model, akis)
+        baslat()
+        baslangic = son_olay = time.monotonic()
+        kazanan = None
+        hatalar = 0
+        try:
+            while True:
+                sinir = son_olay + self.deadline
+                hedge_bekliyor = kazanan is None and esik is not None and len(iptaller) == 1
+                bekle = (min(sinir, baslangic + esik) if hedge_bekliyor else sinir) - time.monotonic()
+                try:
+                    no, tur, veri = kuyruk.get(timeout=max(bekle, 0))
+                except queue.Empty:
+                    if hedge_bekliyor and time.monotonic() < sinir:
+                        baslat()
+                        usage["hedge"] = True
+                        continue
+                    raise CallTimeout(f"{model}: {self.deadline:g} sn içinde yanıt gelmedi")
+                if kazanan is not None and no != kazanan: continue
+                if tur == "hata":
+                    hatalar += 1
+                    if kazanan is not None or hatalar == len(iptaller): raise veri
+                    continue
+                if kazanan is None:
+                    kazanan = no
+                    for i, iptal in enumerate(iptaller):
+                        if i != no: iptal.set()
+                    self._gecikmeler(model, akis).append(time.monotonic() - baslangic)
+                son_olay = time.monotonic()
+                if tur == "bitti":
+                    usage.update(veri)
+                    return
+                yield veri
+        finally:
+            for iptal in iptaller: iptal.set()
+
+    def stream(self, inputs, usage=None, akis=True):
+        if usage is None: usage = {}
+        son_hata = None
+        for sira, model in enumerate(self.chain):
+            devre = self.breaker(model)
+            for deneme in range(self.attempts):
+                if not devre.allow():
+                    son_hata = CircuitOpen(f"{model} geçici olarak devre dışı")
+                    son_hata.sinif = "devre"
+                    break
+                verildi = False
+                try:
+                    for parca in self._calistir(model, inputs, akis, usage):
+                        verildi = True
+                        yield parca
+                    devre.success()
+                    usage.update(model=model, deneme=deneme + 1, yedek=sira > 0)
+                    return
+                except Exception as e:
+                    son_hata = e
+                    sinif = e.sinif = classify_error(e)
+                    if sinif in ("gecici", "kota"): devre.failure()
+                    else: devre.success()
+                    # Yarım kalan akış tekrarlanamaz; kalıcı hata başka modelde de kalıcıdır
+                    if verildi or sinif == "kalici": raise
+                    if sinif == "model": break
+                    if deneme < self.attempts - 1: time.sleep(self._bekleme(deneme, sinif))
+        raise son_hata
+
+    def generate(self, inputs, usage=None):
+        return "".join(self.stream(inputs, usage, akis=False))
+
+# Denemeleri yürüten havuz ve model durumu tüm çağrı nesnelerince paylaşılır: anahtar başına önbellekten
+# düşen çağrı nesnesi kapatılmamış bir havuz bırakmaz, geçmişini de kaybetmez
+@st.cache_resource(show_spinner=False)
+def cagri_havuzu():
+    return ThreadPoolExecutor(max_workers=int(ayar("CAGRI_ISCI")), thread_name_prefix="cagri")
+
+@st.cache_resource(show_spinner=False)
+def cagri_durumu(tur):
+    return CallerState()
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_caller(tur, api_key):
+    yedekler = [m.strip() for m in ayar("MODEL_YEDEKLERI").split(",") if m.strip()]
+    return ResilientCaller(
+        get_backend(tur, api_key),
+        [ayar("MODEL_ADI")] + [m for m in yedekler if m != ayar("MODEL_ADI")],
+        deadline=float(ayar("CAGRI_SURE_SN")),
+        attempts=int(ayar("CAGRI_DENEME")),
+        backoff=float(ayar("CAGRI_BEKLEME_SN")),
+        hedge_percentile=float(ayar("HEDGE_YUZDELIK")),
+        hedge_min_samples=int(ayar("HEDGE_MIN_ORNEK")),
+        breaker_threshold=int(ayar("DEVRE_ESIK")),
+        breaker_cooldown=float(ayar("DEVRE_SURE_SN")),
+        limiter=istek_sinirlayici(),
+        state=cagri_durumu(tur),
+        pool=cagri_havuzu(),
+    )
+
+def aktif_cagri():
+    tur = ayar("MODEL_ARKA_UC")
+    return get_caller(tur, api_key if tur != "yerel" else None)
+
+# Çağrı nesnesi önbellekte yaşar, script her çalıştırmada yeniden yürütülür; bu yüzden sınıf,
+# isinstance'a (yeni çalıştırmanın sınıflarına) değil hatanın üstüne yazılan etikete bakılarak alınır
+def hata_metni(e):
+    return f"Sistem Hatası ({getattr(e, 'sinif', None) or classify_error(e)}): {e}"
+
+# --- MODEL FONKSİYONU ---
+# Gönderilen ek ve metinlerin toplam boyutu (ölçüm kaydı için)
+def _girdi_bayt(inputs):
+    toplam = 0
+    for p in _leaf_parts(inputs):
+        if isinstance(p, str): toplam += len(p.encode("utf-8"))
+        elif isinstance(p, dict) and "ek" in p: toplam += p["boyut"]
+        elif isinstance(p, dict) and "data" in p: toplam += len(p["data"])
+    return toplam
+
+def _model_olcumu(kayit, usage, metin):
+    kayit.update(giris_token=usage.get("giris", 0), cikis_token=usage.get("cikis", 0), cikis_bayt=len(metin.encode("utf-8")),
+                 kullanilan_model=usage.get("model"), deneme=usage.get("deneme", 1), hedge=bool(usage.get("hedge")))
+
+def get_gemini_response(inputs, usage=None):
+    if not model_hazir(): return "Hata: API Anahtarı Eksik."
+    if not isinstance(inputs, list): inputs = [inputs]
+    if usage is None: usage = {}
+    cagri = aktif_cagri()
+    model_adi = ayar("MODEL_ADI")
+    onbellek = yanit_onbellegi()
+    anahtar = content_hash([cagri.backend.name, model_adi] + inputs)
+    with olcum("model", tur="tam", model=model_adi, giris_bayt=_girdi_bayt(inputs)) as kayit:
+        kayitli = onbellek.get(anahtar)
+        if kayitli is not None:
+            usage.update(giris=0, cikis=0, onbellek=True)
+            kayit["onbellek"] = True
+            return kayitli
+        baslangic = time.perf_counter()
+        try:
+            metin = cagri.generate(inputs, usage)
+            # Yedek modelin yanıtı ana modelin anahtarıyla önbelleğe girmez
+            if not usage.get("yedek"): onbellek.put(anahtar, metin)
+            gecikme_kaydi().append({"tur": "tam", "ttft": None, "toplam": time.perf_counter() - baslangic})
+            _model_olcumu(kayit, usage, metin)
+            return metin
+        except Exception as e:
+            kayit["hata"] = type(e).__name__
+            return hata_metni(e)
+
+# Yanıtı üretildikçe parça parça veren sürüm (arka plan işleri ve sohbet kullanır).
+# Hiç metin gelmeden düşen çağrı hata metni verir; akış yarıda keserse hata metni yanıtın
+# sonuna eklenmez, istisna yükselir ve yarım yanıt hiçbir yerde sonuç olarak saklanmaz.
+# Her iki durumda da usage["hata"] doldurulur.
+def stream_gemini_response(inputs, usage=None):
+    if not model_hazir():
+        yield "Hata: API Anahtarı Eksik."
+        return
+    if not isinstance(inputs, list): inputs = [inputs]
+    if usage is None: usage = {}
+    cagri = aktif_cagri()
+    model_adi = ayar("MODEL_ADI")
+    onbellek = yanit_onbellegi()
+    anahtar = content_hash([cagri.backend.name, model_adi] + inputs)
+    with olcum("model", tur="akis", model=model_adi, giris_bayt=_girdi_bayt(inputs)) as kayit:
+        kayitli = onbellek.get(anahtar)
+        if kayitli is not None:
+            usage.update(giris=0, cikis=0, onbellek=True)
+            kayit["onbellek"] = True
+            yield kayitli
+            return
+        baslangic = time.perf_counter()
+        ilk_token = None
+        parcalar = []
+        try:
+            for metin in cagri.stream(inputs, usage):
+                if ilk_token is None:
+                    ilk_token = time.perf_counter() - baslangic
+                    kayit["ttft_ms"] = round(ilk_token * 1000, 2)
+                parcalar.append(metin)
+                yield metin
+            if not usage.get("yedek"): onbellek.put(anahtar, "".join(parcalar))
+            gecikme_kaydi().append({"tur": "akis", "ttft": ilk_token, "toplam": time.perf_counter() - baslangic})
+            _model_olcumu(kayit, usage, "".join(parcalar))
+        except Exception as e:
+            kayit["hata"] = type(e).__name__
+            usage["hata"] = hata_metni(e)
+            if parcalar: raise
+            yield usage["hata"]
+
+# Soru çözümlerinde modelin formül listesinden önce yazdığı ayraç; çözüm ve formüller bundan bölünür
+FORMUL_AYRACI = "---FORMÜLLER---"
+
+# --- SOHBET MOTORU ---
+# Çok turlu yerel sohbet: ekler bir kez yüklenip referansla gönderilir, geçmiş token
+# bütçesini aşınca eski turlar özetlenir. Böylece 30. turun maliyeti 3. turunkine yakın kalır.
+def hata_mi(metin):
+    return metin.startswith(("Sistem Hatası", "Hata:"))
+
+class Conversation:
+    def __init__(self, system, opening=None, budget=4000, keep_last=6):
+        self.system = system
+        self.opening = opening
+        self.budget = budget
+        self.keep_last = keep_last + keep_last % 2
+        self.summary = ""
+        self.turns = []
+        self.usage_log = []
+        self._attachments = {}
+        # Tur işi ve özetleme işi arka planda, script ise okurken durumu paylaşır
+        self._lock = threading.Lock()
+        self._ozetleniyor = False
+
+    # Ek deposu referansı alır; yükleme ilk gönderimde yapılır, böylece script değil
+    # arka plan işi beklemiş olur. Sohbet yalnızca özeti ve yükleme referansını tutar.
+    def attach(self, parca):
+        anahtar = parca["ek"]
+        with self._lock:
+            if anahtar not in self._attachments: self._attachments[anahtar] = parca
+        return anahtar
+
+    def contents(self):
+        with self._lock:
+            ekler = dict(self._attachments)
+        for anahtar, ek in ekler.items():
+            if "ek" in ek: ekler[anahtar] = aktif_backend().upload(ek_deposu().get(anahtar), ek["mime_type"])
+        with self._lock:
+            self._attachments.update((k, v) for k, v in ekler.items() if k in self._attachments)
+            giris = [self.system]
+            if self.summary: giris.append(f"Önceki konuşmanın özeti:\n{self.summary}")
+            icerik = [
+                {"role": "user", "parts": giris + list(self._attachments.values())},
+                {"role": "model", "parts": [self.opening or "Anlaşıldı."]},
+            ]
+            icerik += [{"role": t["role"], "parts": [t["text"]]} for t in self.turns]
+        return icerik
+
+    def _tokenlar(self):
+        return estimate_tokens(self.summary) + sum(estimate_tokens(t["text"]) for t in self.turns)
+
+    def history_tokens(self):
+        with self._lock:
+            return self._tokenlar()
+
+    def send(self, text):
+        with self._lock:
+            # Yarıda kalmış bir turun cevapsız kullanıcı mesajı sıralamayı bozmasın
+            if self.turns and self.turns[-1]["role"] == "user": self.turns.pop()
+            self.turns.append({"role": "user", "text": text})
+        usage = {}
+        parcalar = []
+        try:
+            for parca in stream_gemini_response(self.contents(), usage):
+                parcalar.append(parca)
+                yield parca
+        except Exception:
+            # Yarıda kesilen yanıt geçmişe girmez
+            with self._lock: self.turns.pop()
+            raise
+        with self._lock:
+            if usage.get("hata"):
+                self.turns.pop()
+                return
+            self.turns.append({"role": "model", "text": "".join(parcalar)})
+            self.usage_log.append({"giris": usage.get("giris", 0), "cikis": usage.get("cikis", 0)})
+            ozetle = self._ozet_gerekli()
+        # Özetleme ayrı bir iş: tur, özet çağrısını beklemeden biter; arayüz yanıtı hemen gösterir
+        if ozetle: is_yoneticisi().submit(("ozet", id(self)), lambda job: self.compact())
+
+    def _ozet_gerekli(self):
+        return not self._ozetleniyor and self._tokenlar() > self.budget and len(self.turns) > self.keep_last
+
+    # Özet çağrısı kilitsiz yapılır; bu sırada eklenen turlar sona gelir, özetlenen baş kısım değişmez
+    def compact(self):
+        with self._lock:
+            if not self._ozet_gerekli(): return
+            self._ozetleniyor = True
+            kes = len(self.turns) - self.keep_last
+            if self.turns[kes]["role"] != "user": kes += 1
+            eski = "\n".join(f"{'Kullanıcı' if t['role'] == 'user' else 'Asistan'}: {t['text']}" for t in self.turns[:kes])
+            onceki = self.summary
+        try:
+            ozet = get_gemini_response(
+                "Aşağıdaki konuşmayı, sonraki turlarda bağlam olarak kullanılacak şekilde kısa ama "
+                "önemli bilgileri (isimler, sayılar, kararlar, sorulan sorular) kaybetmeden özetle.\n"
+                f"Mevcut özet: {onceki or '-'}\n\n{eski}"
+            )
+        finally:
+            with self._lock: self._ozetleniyor = False
+        if hata_mi(ozet): return
+        with self._lock:
+            self.summary = ozet
+            del self.turns[:kes]
+
+    def transcript(self):
+        with self._lock:
+            satirlar = [f"Özet: {self.summary}"] if self.summary else []
+            if self.opening: satirlar.append(f"Asistan: {self.opening}")
+            satirlar += [f"{'Kullanıcı' if t['role'] == 'user' else 'Asistan'}: {t['text']}" for t in self.turns]
+        return "\n".join(satirlar)
+
+    def usage_caption(self):
+        if not self.usage_log: return ""
+        son = self.usage_log[-1]
+        return f"Bu tur: {son['giris']} giriş + {son['cikis']} çıkış token · Geçmiş ≈{self.history_tokens()} token"
+
+def yeni_sohbet(system, opening=None):
+    return Conversation(system, opening, budget=int(ayar("SOHBET_TOKEN_BUTCESI")), keep_last=int(ayar("SOHBET_SON_TUR")))
+
+# --- DERS DEPOSU ---
+# Dersler ve kayıtları (çözülen sorular, formüller, özetler, sınavlar) SQLite'ta kalıcı tutulur.
+# Oturumda yalnızca aktif ders adı durur; içerik sayfa sayfa sorgulanır, FTS5 ile aranır.
+KAYIT_TURLERI = {"soru": "Çözüm", "formul": "Formül", "ozet": "Özet", "sinav": "Sınav"}
+
+# Çözümün formül kısmı satır satır ayrıştırılır: madde işaretleri ve markdown atılır, "Ad: ifade"
+# biçimindeki açıklama ayrılır, yalnızca eşitlik/eşitsizlik içeren satırlar formül sayılır.
+# Kanonik biçim (boşluksuz, ortak işaretler, yanlar sıralı) aynı formülün tekrarını yakalar.
+_FORMUL_ISLEC = re.compile(r"=|≈|≤|≥|<|>")
+_FORMUL_ISARET = str.maketrans({"·": "*", "×": "*", "⋅": "*", "−": "-", "–": "-", "÷": "/", "²": "^2", "³": "^3", "√": "sqrt"})
+_LATEX_SEMBOL = re.compile(r"\\(left|right|,|;|!|quad)")
+_SEMBOL = re.compile(r"\\?([A-Za-zΑ-Ωα-ω][A-Za-z0-9Α-Ωα-ω]*(?:_\{?\w+\}?)?)")
+_SEMBOL_DISI = {"sin", "cos", "tan", "cot", "log", "ln", "exp", "sqrt", "frac", "cdot", "times", "dfrac", "text", "mathrm", "int", "sum", "lim", "max", "min"}
+
+def _formul_satiri(satir):
+    satir = re.sub(r"^\s*(?:[-*•+]|\d+[.)])\s*", "", satir)
+    satir = satir.replace("**", "").replace("`", "").replace("$", "").strip()
+    aciklama = ""
+    on, ayrac, son = satir.partition(":")
+    if ayrac and _FORMUL_ISLEC.search(son) and not _FORMUL_ISLEC.search(on):
+        aciklama, satir = on.strip(), son.strip()
+    return aciklama, satir
+
+def canonical_formula(ifade):
+    ifade = _LATEX_SEMBOL.sub("", ifade.translate(_FORMUL_ISARET)).replace("**", "^").replace("\\cdot", "*").replace("\\times", "*")
+    ifade = re.sub(r"\s+", "", ifade)
+    yanlar = ifade.split("=")
+    return "=".join(sorted(yanlar)) if len(yanlar) == 2 else ifade
+
+def formula_symbols(ifade):
+    return sorted({m for m in _SEMBOL.findall(ifade) if m.lower() not in _SEMBOL_DISI})
+
+def parse_formulas(metin):
+    formuller = {}
+    for satir in metin.splitlines():
+        aciklama, ifade = _formul_satiri(satir)
+        if len(ifade) < 3 or not _FORMUL_ISLEC.search(ifade): continue
+        kanonik = canonical_formula(ifade)
+        anahtar = hashlib.sha1(kanonik.encode("utf-8")).hexdigest()[:16]
+        formuller.setdefault(anahtar, {"anahtar": anahtar, "metin": ifade, "aciklama": aciklama, "semboller": formula_symbols(ifade)})
+    return list(formuller.values())
+
+class CourseStore:
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        self._db.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA foreign_keys=ON;
+            CREATE TABLE IF NOT EXISTS dersler (
+                id INTEGER PRIMARY KEY, alan TEXT NOT NULL, ad TEXT NOT NULL,
+                olusturma REAL NOT NULL, UNIQUE(alan, ad));
+            CREATE TABLE IF NOT EXISTS kayitlar (
+                id INTEGER PRIMARY KEY,
+                ders_id INTEGER NOT NULL REFERENCES dersler(id) ON DELETE CASCADE,
+                tur TEXT NOT NULL, baslik TEXT NOT NULL DEFAULT '', icerik TEXT NOT NULL,
+                olusturma REAL NOT NULL, indekslendi INTEGER NOT NULL DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS kayit_ders_tur ON kayitlar(ders_id, tur, id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS kayit_fts USING fts5(
+                icerik, baslik, content='kayitlar', content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2');
+            CREATE TRIGGER IF NOT EXISTS kayit_ekle AFTER INSERT ON kayitlar BEGIN
+                INSERT INTO kayit_fts(rowid, icerik, baslik) VALUES (new.id, new.icerik, new.baslik);
+            END;
+            CREATE TRIGGER IF NOT EXISTS kayit_sil AFTER DELETE ON kayitlar BEGIN
+                INSERT INTO kayit_fts(kayit_fts, rowid, icerik, baslik) VALUES ('delete', old.id, old.icerik, old.baslik);
+            END;
+            CREATE TABLE IF NOT EXISTS formuller (
+                id INTEGER PRIMARY KEY,
+                ders_id INTEGER NOT NULL REFERENCES dersler(id) ON DELETE CASCADE,
+                anahtar TEXT NOT NULL, metin TEXT NOT NULL, aciklama TEXT NOT NULL DEFAULT '',
+                semboller TEXT NOT NULL DEFAULT '', UNIQUE(ders_id, anahtar));
+            CREATE TABLE IF NOT EXISTS formul_kaynak (
+                formul_id INTEGER NOT NULL REFERENCES formuller(id) ON DELETE CASCADE,
+                kayit_id INTEGER NOT NULL REFERENCES kayitlar(id) ON DELETE CASCADE,
+                PRIMARY KEY(formul_id, kayit_id));
+            CREATE TABLE IF NOT EXISTS formul_sembol (
+                sembol TEXT NOT NULL,
+                formul_id INTEGER NOT NULL REFERENCES formuller(id) ON DELETE CASCADE,
+                PRIMARY KEY(sembol, formul_id));
+        """)
+        # Eski veritabanlarında işaret sütunu yok: eklenir, bağlantısı olan bloklar işlenmiş sayılır
+        if "indekslendi" not in {r["name"] for r in self._db.execute("PRAGMA table_info(kayitlar)")}:
+            with self._db:
+                self._db.execute("ALTER TABLE kayitlar ADD COLUMN indekslendi INTEGER NOT NULL DEFAULT 0")
+                self._db.execute("UPDATE kayitlar SET indekslendi = 1 WHERE id IN (SELECT kayit_id FROM formul_kaynak)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS kayit_indekssiz ON kayitlar(id) WHERE tur = 'formul' AND indekslendi = 0")
+        # Dizinden önce kaydedilmiş formül bloklarını bir kez ayrıştır; formül satırı çıkmayan
+        # bloklar da işaretlenir, her açılışta yeniden ayrıştırılmaz
+        with self._db:
+            for r in self._db.execute(
+                    "SELECT id, ders_id, icerik FROM kayitlar WHERE tur = 'formul' AND indekslendi = 0").fetchall():
+                self._index_formulas(r["ders_id"], r["id"], r["icerik"])
+
+    def _query(self, sql, args=()):
+        with self._lock:
+            return self._db.execute(sql, args).fetchall()
+
+    def _write(self, sql, args=()):
+        with self._lock, self._db:
+            return self._db.execute(sql, args).lastrowid
+
+    def _course_id(self, alan, ders):
+        satir = self._query("SELECT id FROM dersler WHERE alan = ? AND ad = ?", (alan, ders))
+        return satir[0]["id"] if satir else None
+
+    def courses(self, alan):
+        return [r["ad"] for r in self._query("SELECT ad FROM dersler WHERE alan = ? ORDER BY id", (alan,))]
+
+    def add_course(self, alan, ders):
+        try:
+            self._write("INSERT INTO dersler (alan, ad, olusturma) VALUES (?, ?, ?)", (alan, ders, time.time()))
+            return True
+        except sqlite3.IntegrityError:
+            return False
+
+    def delete_course(self, alan, ders):
+        self._write("DELETE FROM dersler WHERE alan = ? AND ad = ?", (alan, ders))
+
+    def add(self, alan, ders, tur, icerik, baslik=""):
+        ders_id = self._course_id(alan, ders)
+        if ders_id is None: return None
+        with self._lock, self._db:
+            kayit_id = self._db.execute(
+                "INSERT INTO kayitlar (ders_id, tur, baslik, icerik, olusturma) VALUES (?, ?, ?, ?, ?)",
+                (ders_id, tur, baslik, icerik, time.time()),
+            ).lastrowid
+            if tur == "formul": self._index_formulas(ders_id, kayit_id, icerik)
+        return kayit_id
+
+    # Formül bloğundaki her formül ders içinde tekil tutulur; blok (kaynak soru) yalnızca bağlanır
+    def _index_formulas(self, ders_id, kayit_id, metin):
+        for f in parse_formulas(metin):
+            self._db.execute(
+                "INSERT OR IGNORE INTO formuller (ders_id, anahtar, metin, aciklama, semboller) VALUES (?, ?, ?, ?, ?)",
+                (ders_id, f["anahtar"], f["metin"], f["aciklama"], " ".join(f["semboller"])))
+            formul_id = self._db.execute("SELECT id FROM formuller WHERE ders_id = ? AND anahtar = ?", (ders_id, f["anahtar"])).fetchone()["id"]
+            self._db.execute("INSERT OR IGNORE INTO formul_kaynak VALUES (?, ?)", (formul_id, kayit_id))
+            self._db.executemany("INSERT OR IGNORE INTO formul_sembol VALUES (?, ?)", [(s, formul_id) for s in f["semboller"]])
+        self._db.execute("UPDATE kayitlar SET indekslendi = 1 WHERE id = ?", (kayit_id,))
+
+    # Süzgeç bilinen bir sembolse sembol dizininden, değilse formül/açıklama metninde aranır
+    def _formula_filter(self, filtre):
+        if not filtre: return "", ()
+        return (" AND (f.id IN (SELECT formul_id FROM formul_sembol WHERE sembol = ?) OR (NOT EXISTS "
+                "(SELECT 1 FROM formul_sembol WHERE sembol = ?) AND (f.metin LIKE ? OR f.aciklama LIKE ?)))",
+                (filtre, filtre, f"%{filtre}%", f"%{filtre}%"))
+
+    def formula_count(self, alan, ders, filtre=""):
+        kosul, args = self._formula_filter(filtre)
+        return self._query(
+            "SELECT COUNT(*) AS n FROM formuller f JOIN dersler d ON d.id = f.ders_id "
+            "WHERE d.alan = ? AND d.ad = ?" + kosul, (alan, ders, *args))[0]["n"]
+
+    # İlk görülme sırasıyla; adet = formülün geçtiği soru sayısı
+    def formulas(self, alan, ders, filtre="", limit=None, offset=0):
+        kosul, args = self._formula_filter(filtre)
+        return [dict(r) for r in self._query(
+            "SELECT f.id, f.metin, f.aciklama, f.semboller, COUNT(fk.kayit_id) AS adet, "
+            "GROUP_CONCAT(NULLIF(k.baslik, ''), ' · ') AS kaynaklar "
+            "FROM formuller f JOIN dersler d ON d.id = f.ders_id "
+            "LEFT JOIN formul_kaynak fk ON fk.formul_id = f.id LEFT JOIN kayitlar k ON k.id = fk.kayit_id "
+            "WHERE d.alan = ? AND d.ad = ?" + kosul + " GROUP BY f.id ORDER BY f.id LIMIT ? OFFSET ?",
+            (alan, ders, *args, -1 if limit is None else limit, offset))]
+
+    def count(self, alan, ders, tur):
+        return self._query(
+            "SELECT COUNT(*) AS n FROM kayitlar k JOIN dersler d ON d.id = k.ders_id "
+            "WHERE d.alan = ? AND d.ad = ? AND k.tur = ?", (alan, ders, tur))[0]["n"]
+
+    # Eskiden yeniye sıralı sayfa; limit=None tüm kayıtlar
+    def items(self, alan, ders, tur, limit=None, offset=0):
+        return [dict(r) for r in self._query(
+            "SELECT k.id, k.tur, k.baslik, k.icerik, k.olusturma FROM kayitlar k JOIN dersler d ON d.id = k.ders_id "
+            "WHERE d.alan = ? AND d.ad = ? AND k.tur = ? ORDER BY k.id LIMIT ? OFFSET ?",
+            (alan, ders, tur, -1 if limit is None else limit, offset))]
+
+    def search(self, alan, ders, sorgu, limit=20):
+        # Kullanıcı metni FTS sözdizimine girmesin: her kelime tırnaklı önek araması olur
+        kelimeler = re.findall(r"\w+", sorgu)
+        if not kelimeler: return []
+        fts = " ".join(f'"{k}"*' for k in kelimeler)
+        return [dict(r) for r in self._query(
+            "SELECT k.id, k.tur, k.baslik, k.icerik, "
+            "snippet(kayit_fts, 0, '**', '**', ' … ', 16) AS parca "
+            "FROM kayit_fts JOIN kayitlar k ON k.id = kayit_fts.rowid JOIN dersler d ON d.id = k.ders_id "
+            "WHERE kayit_fts MATCH ? AND d.alan = ? AND d.ad = ? ORDER BY bm25(kayit_fts) LIMIT ?",
+            (fts, alan, ders, limit))]
+
+    # Bağlam seçimi için aday kayıtlar: sorgu varsa BM25 puanıyla (kelimelerden biri yeterli),
+    # yoksa puansız olarak dersin ilk kaydından sonuncusuna eşit aralıklarla seçilmiş en çok
+    # limit kayıt; böylece büyük derslerde de eski konular aday olur. Aralık yalnızca kimlikler
+    # üzerinden hesaplanır, içerik sadece seçilenler için okunur. FTS dizini tetikleyicilerle güncel kalır.
+    def rank(self, alan, ders, sorgu, turler, limit=200):
+        yer = ", ".join("?" * len(turler))
+        kelimeler = re.findall(r"\w+", sorgu or "")
+        if not kelimeler:
+            return [dict(r) for r in self._query(
+                "SELECT id, tur, baslik, icerik, NULL AS skor FROM kayitlar WHERE id IN ("
+                "SELECT id FROM (SELECT k.id, ROW_NUMBER() OVER (ORDER BY k.id) AS sira, COUNT(*) OVER () AS toplam "
+                f"FROM kayitlar k JOIN dersler d ON d.id = k.ders_id WHERE d.alan = ? AND d.ad = ? AND k.tur IN ({yer})) "
+                "WHERE sira * ? / toplam > (sira - 1) * ? / toplam) ORDER BY id",
+                (alan, ders, *turler, limit, limit))]
+        fts = " OR ".join(f'"{k}"*' for k in kelimeler)
+        return [dict(r) for r in self._query(
+            "SELECT k.id, k.tur, k.baslik, k.icerik, -bm25(kayit_fts) AS skor "
+            "FROM kayit_fts JOIN kayitlar k ON k.id = kayit_fts.rowid JOIN dersler d ON d.id = k.ders_id "
+            f"WHERE kayit_fts MATCH ? AND d.alan = ? AND d.ad = ? AND k.tur IN ({yer}) ORDER BY bm25(kayit_fts) LIMIT ?",
+            (fts, alan, ders, *turler, limit))]
+
+@st.cache_resource(show_spinner=False)
+def ders_deposu():
+    return CourseStore(os.path.join(ayar("VERI_DIZINI"), "dersler.sqlite3"))
+
+# Varsayılan ad oturuma özel ve rastgeledir: aynı sunucudaki öğrenciler birbirinin derslerini görmez.
+# Ad adreste (?alan=...) de tutulur; sayfa yenilense, oturum temizlense ya da adres yer iminden
+# yeni bir tarayıcı oturumunda açılsa bile aynı alana dönülür. Ad elle girilerek de geri alınabilir.
+def calisma_alani():
+    return (st.session_state.get("calisma_alani") or st.query_params.get("alan")
+            or st.session_state.setdefault("varsayilan_alan", "alan-" + os.urandom(5).hex()))
+
+# --- SINAV BAĞLAMI ---
+# Örnek sınavın bağlamı dersin tamamından seçilir: konu verilirse ilgili kayıtlar BM25 puanıyla,
+# verilmezse dersin geneline en çok benzeyenler öne çıkar. Adaylar MMR ile (ilgi − zaten seçilenlere
+# benzerlik) sırayla alınır; böylece aynı sorunun kopyaları yerine farklı konular token bütçesine sığar.
+def _terimler(metin):
+    return Counter(t for t in re.findall(r"\w+", metin.lower()) if len(t) > 2)
+
+def _kosinus(a, b):
+    if len(a) > len(b): a, b = b, a
+    ic = sum(v * b.get(t, 0.0) for t, v in a.items())
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return ic / norm if norm else 0.0
+
+def select_context(adaylar, budget, lam=0.7):
+    if not adaylar: return []
+    df = Counter()
+    tf = [_terimler(f"{a['baslik']} {a['icerik']}") for a in adaylar]
+    for v in tf: df.update(v.keys())
+    idf = {t: math.log(1 + len(adaylar) / n) for t, n in df.items()}
+    vektorler = [{t: f * idf[t] for t, f in v.items()} for v in tf]
+    skorlar = [a["skor"] for a in adaylar]
+    if any(s is None for s in skorlar):
+        merkez = Counter()
+        for v in vektorler: merkez.update(v)
+        skorlar = [_kosinus(v, merkez) for v in vektorler]
+    tepe = max(skorlar) or 1.0
+    ilgi = [s / tepe for s in skorlar]
+
+    # Tek bir uzun kayıt bütçeyi yutmasın
+    kayit_siniri = max(budget // 3, 50) * 4
+    secilen, kalan, harcanan = [], set(range(len(adaylar))), 0
+    benzerlik = [0.0] * len(adaylar)
+    while kalan:
+        i = max(kalan, key=lambda j: lam * ilgi[j] - (1 - lam) * benzerlik[j])
+        kalan.discard(i)
+        metin = adaylar[i]["icerik"][:kayit_siniri]
+        maliyet = estimate_tokens(metin)
+        if harcanan + maliyet > budget: continue
+        harcanan += maliyet
+        secilen.append({**adaylar[i], "icerik": metin})
+        for j in kalan: benzerlik[j] = max(benzerlik[j], _kosinus(vektorler[i], vektorler[j]))
+    return secilen
+
+def sinav_baglami(alan, ders, konu=""):
+    adaylar = ders_deposu().rank(alan, ders, konu, ("soru", "ozet", "formul"), int(ayar("SINAV_ADAY")))
+    secilen = select_context(adaylar, int(ayar("SINAV_BAGLAM_TOKEN")), float(ayar("SINAV_MMR_LAMBDA")))
+    return "\n\n".join(f"[{KAYIT_TURLERI[k['tur']]}{': ' + k['baslik'] if k['baslik'] else ''}]\n{k['icerik']}" for k in secilen), secilen
+
+# --- EK DEPOSU ---
+# Yüklenen dosyalar (görseller ön işlenmiş hâliyle) içerik özetiyle diskteki ortak depoya bir
+# kez yazılır; oturumlar, sohbetler ve işler yalnızca {"ek": özet, "mime_type", "boyut"} taşır.
+# Aynı dosyayı yükleyen öğrenciler aynı kaydı paylaşır. Okuma mmap ile kopyasız yapılır;
+# açık eşlemelerin toplamı ve disk kullanımı kotalıdır, en uzun süredir dokunulmayan çıkarılır.
+class AttachmentStore:
+    def __init__(self, path, disk_limit, map_limit):
+        os.makedirs(path, exist_ok=True)
+        self.dir = path
+        self.disk_limit = disk_limit
+        self.map_limit = map_limit
+        self.disk_size = 0
+        self.map_size = 0
+        self._files = OrderedDict()  # özet -> (mime, boyut), LRU sırasıyla
+        self._maps = OrderedDict()   # özet -> mmap
+        self._lock = threading.Lock()
+        # Önceki çalışmadan kalan dosyalar son dokunulma sırasıyla geri alınır
+        eskiler = []
+        for ad in os.listdir(path):
+            ozet, _, mime = ad.partition(".")
+            if ad.startswith(".") or not mime: continue  # yarım kalmış geçici yazım
+            yol = os.path.join(path, ad)
+            eskiler.append((os.path.getmtime(yol), ozet, mime.replace("_", "/", 1), os.path.getsize(yol)))
+        for _, ozet, mime, boyut in sorted(eskiler):
+            self._files[ozet] = (mime, boyut)
+            self.disk_size += boyut
+        with self._lock: self._evict_disk()
+
+    def _yol(self, ozet, mime_type):
+        return os.path.join(self.dir, f"{ozet}.{mime_type.replace('/', '_')}")
+
+    def put(self, data, mime_type):
+        ozet = hashlib.sha256(data).hexdigest()
+        parca = {"ek": ozet, "mime_type": mime_type, "boyut": len(data)}
+        with self._lock:
+            if ozet in self._files:
+                self._files.move_to_end(ozet)
+                return parca
+        # Geçici dosyaya yazıp yeniden adlandırma: yarım dosya hiçbir zaman okunmaz
+        gecici = os.path.join(self.dir, f".{ozet}.{threading.get_ident()}")
+        with open(gecici, "wb") as f: f.write(data)
+        os.replace(gecici, self._yol(ozet, mime_type))
+        with self._lock:
+            if ozet not in self._files:
+                self._files[ozet] = (mime_type, len(data))
+                self.disk_size += len(data)
+            self._evict_disk()
+        return parca
+
+    def has(self, ozet):
+        with self._lock: return ozet in self._files
+
+    # Kotadan düşmüş ek, çıplak KeyError (özet metni) yerine anlaşılır bir hatayla bildirilir
+    def _dokun(self, ozet):
+        if ozet not in self._files: raise FileNotFoundError("Ek artık depoda değil; dosyayı yeniden yükleyin.")
+        self._files.move_to_end(ozet)
+        return self._files[ozet]
+
+    def path(self, ozet):
+        with self._lock:
+            return self._yol(ozet, self._dokun(ozet)[0])
+
+    # Salt okunur, kopyasız görünüm; eşleme kotadan düşse de görünüm yaşadıkça geçerlidir
+    def get(self, ozet):
+        with self._lock:
+            mime, boyut = self._dokun(ozet)
+            if ozet in self._maps:
+                self._maps.move_to_end(ozet)
+                return memoryview(self._maps[ozet])
+            if not boyut: return memoryview(b"")
+            with open(self._yol(ozet, mime), "rb") as f:
+                eslem = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[ozet] = eslem
+            self.map_size += boyut
+            while self.map_size > self.map_limit and len(self._maps) > 1:
+                # Kapatılmaz: dışarıdaki görünümler bırakılınca eşleme kendiliğinden kalkar
+                self.map_size -= len(self._maps.popitem(last=False)[1])
+            return memoryview(eslem)
+
+    def _evict_disk(self):
+        while self.disk_size > self.disk_limit and len(self._files) > 1:
+            ozet, (mime, boyut) = self._files.popitem(last=False)
+            self.disk_size -= boyut
+            if ozet in self._maps: self.map_size -= len(self._maps.pop(ozet))
+            try: os.remove(self._yol(ozet, mime))
+            except OSError: pass
+
+    def stats(self):
+        with self._lock:
+            return {"dosya": len(self._files), "disk": self.disk_size, "eslenen": self.map_size, "eslem": len(self._maps)}
+
+@st.cache_resource(show_spinner=False)
+def ek_deposu():
+    return AttachmentStore(os.path.join(ayar("VERI_DIZINI"), "ekler"),
+                           int(ayar("EK_DISK_MB")) * 1024 * 1024, int(ayar("EK_BELLEK_MB")) * 1024 * 1024)
+
+def ek_baytlari(parca):
+    return bytes(ek_deposu().get(parca["ek"]))
+
+# Referanslar yalnızca istek ağa çıkarken bayta çevrilir (çok turlu içerikler dahil)
+def ek_cozumle(inputs):
+    def coz(p):
+        if isinstance(p, dict) and "parts" in p: return {**p, "parts": [coz(x) for x in p["parts"]]}
+        if not (isinstance(p, dict) and "ek" in p): return p
+        return {"mime_type": p["mime_type"], "data": ek_baytlari(p)}
+    return [coz(p) for p in inputs]
+
+# Oturum yalnızca yükleme kimliği -> ek referansını tutar; kayıt kotadan düşmüşse yeniden üretilir
+def oturum_eki(anahtar, uretici):
+    kimlikler = st.session_state.setdefault("ek_kimlikleri", {})
+    parca = kimlikler.get(anahtar)
+    if parca is None or not ek_deposu().has(parca["ek"]):
+        parca = kimlikler[anahtar] = uretici()
+    return parca
+
+# Oturum durumunun kaba bellek boyutu (Streamlit'in tuttuğu yükleme nesneleri dahil)
+def oturum_bellegi():
+    gorulen = set()
+    def boyut(o):
+        if id(o) in gorulen: return 0
+        gorulen.add(id(o))
+        n = sys.getsizeof(o)
+        if isinstance(o, dict): n += sum(boyut(k) + boyut(v) for k, v in o.items())
+        elif isinstance(o, (list, tuple, set, deque)): n += sum(boyut(x) for x in o)
+        elif hasattr(o, "__dict__") and not isinstance(o, type): n += boyut(vars(o))
+        return n
+    return sum(boyut(st.session_state[k]) for k in list(st.session_state.keys()))
+
+# Bu oturumun referans verdiği ekler (yüklemeler ve sohbetlere eklenenler)
+def oturum_ekleri():
+    ekler = {p["ek"]: p["boyut"] for p in st.session_state.get("ek_kimlikleri", {}).values()}
+    for deger in list(st.session_state.values()):
+        if hasattr(deger, "_attachments"):
+            ekler.update((k, ekler.get(k, 0)) for k in list(deger._attachments))
+    return ekler
+
+# --- GÖRSEL ÖN İŞLEME ---
+# Telefon fotoğrafları (12 MP) modele ham gitmesin: EXIF yönü düzeltilir, küçültülür,
+# belge ise gri ton/ikili yapılıp kenar boşlukları kırpılır ve sıkıştırılır.
+# Sonuç ek deposuna yazılır ve oturumda referansı tutulur; her yeniden çalıştırmada tekrar çözülmez.
+def preprocess_image(data, max_side=1600, document=True, binarize=False, quality=85):
+    with olcum("gorsel", bayt=len(data)) as kayit:
+        parca = _preprocess_image(data, max_side, document, binarize, quality)
+        kayit["cikis_bayt"] = len(parca["data"])
+    return parca
+
+# Kağıdın sınırları küçültülmüş görüntüde satır/sütun yoğunluğundan bulunur: önce açık pikseli
+# yeterince olan satırlar seçilir, sütunlar bu satırlar içinde, satırlar da bu sütunlar içinde
+# yeniden daraltılır. Kenardaki gölge kağıda sayılmasın diye kutu biraz içeri alınır.
+def _kagit_kutusu(img, esik=160):
+    kucuk = img.copy()
+    kucuk.thumbnail((200, 200))
+    w, h = kucuk.size
+    # Görüntü gri tonlu (L): her bayt bir piksel
+    acik = [p >= esik for p in kucuk.tobytes()]
+    def araliga(degerler):
+        return (degerler[0], degerler[-1] + 1) if degerler else None
+    satir = araliga([i for i in range(h) if sum(acik[i * w:(i + 1) * w]) > w / 4])
+    if not satir: return None
+    sutun = araliga([j for j in range(w) if sum(acik[i * w + j] for i in range(*satir)) > (satir[1] - satir[0]) / 2])
+    if not sutun: return None
+    satir = araliga([i for i in range(*satir) if sum(acik[i * w + sutun[0]:i * w + sutun[1]]) > (sutun[1] - sutun[0]) / 2])
+    if not satir: return None
+    kx, ky = img.width / w, img.height / h
+    # İçe pay yalnızca görüntü içinde bulunan kağıt kenarına verilir; kağıt kareyi dolduruyorsa kırpılmaz
+    ic = max(img.size) // 100
+    kutu = (int(sutun[0] * kx) + (ic if sutun[0] > 0 else 0), int(satir[0] * ky) + (ic if satir[0] > 0 else 0),
+            int(sutun[1] * kx) - (ic if sutun[1] < w else 0), int(satir[1] * ky) - (ic if satir[1] < h else 0))
+    if kutu[2] <= kutu[0] or kutu[3] <= kutu[1] or kutu == (0, 0, img.width, img.height): return None
+    return kutu
+
+def _preprocess_image(data, max_side, document, binarize, quality):
+    img = Image.open(io.BytesIO(data))
+    # JPEG'de çözme sırasında küçültme: 12 MP fotoğraf tam boy açılmaz
+    img.draft("RGB", (max_side, max_side))
+    img = ImageOps.exif_transpose(img)
+    if document:
+        img = ImageOps.autocontrast(img.convert("L"), cutoff=1)
+        # Önce kağıt (açık renkli ana bölge) bulunur, masa gibi koyu arka plan atılır;
+        # sonra kağıdın içinde yazının çevresi kalacak şekilde boş kenarlar kırpılır
+        kagit = _kagit_kutusu(img)
+        if kagit: img = img.crop(kagit)
+        kutu = img.point(lambda p: 255 if p < 160 else 0).getbbox()
+        if kutu:
+            pay = max(img.size) // 50
+            img = img.crop((max(kutu[0] - pay, 0), max(kutu[1] - pay, 0),
+                            min(kutu[2] + pay, img.width), min(kutu[3] + pay, img.height)))
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+    buf = io.BytesIO()
+    if document and binarize:
+        img.point(lambda p: 255 if p > 150 else 0).convert("1").save(buf, format="PNG", optimize=True)
+        return {"mime_type": "image/png", "data": buf.getvalue()}
+    img.save(buf, format="JPEG", quality=quality, optimize=True)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
+
+# Yüklenen dosyayı ek deposu referansına çevirir (PDF olduğu gibi, görsel ön işlemden geçer).
+# Bayt kopyası yükleme başına bir kez alınır; sonraki çalıştırmalar oturumdaki referansı kullanır.
+def dosya_girdisi(f, document=True):
+    tur = "pdf" if f.type == "application/pdf" else document
+    return oturum_eki(f"{f.file_id}:{tur}", lambda: ek_olustur(f.getvalue(), f.type, document))
+
+def ek_olustur(data, mime_type, document=True):
+    if mime_type == "application/pdf": return ek_deposu().put(data, mime_type)
+    parca = preprocess_image(
+        data,
+        max_side=int(ayar("GORSEL_MAKS_KENAR" if document else "CIZIM_MAKS_KENAR")),
+        document=document,
+        binarize=bool(ayar("GORSEL_IKILI")),
+        quality=int(ayar("GORSEL_JPEG_KALITE")),
+    )
+    return ek_deposu().put(parca["data"], parca["mime_type"])
+
+# PDF'den seçilen sayfalar da depoya yazılır; aynı seçim tekrar ayıklanmaz
+def sayfa_eki(parca, pages):
+    return oturum_eki(f"{parca['ek']}:{'-'.join(map(str, pages))}",
+                      lambda: ek_deposu().put(extract_pages(ek_deposu().path(parca["ek"]), pages), "application/pdf"))
+
+# --- PDF SAYFA SEÇİMİ ---
+# "Sayfa 3, Soru 5", "sayfa 2-4", "s. 7 ve 9", "3. sayfadaki" gibi ifadelerden sayfa numaraları
+# Virgül/"ve" sonrası sayı "15. soru" gibi bir soru numarasıysa alınmaz; (?!\d) geri izlemeyle "1"e düşmeyi önler
+_SAYFA_NO = r"\d+(?!\d)(?:\s*[-–]\s*\d+(?!\d))?"
+_SAYFA_ONCE = re.compile(rf"\b(?:sayfa|sf\.?|s\.)\s*({_SAYFA_NO}(?:\s*(?:,|ve)\s*{_SAYFA_NO}(?!\s*\.?\s*soru))*)", re.IGNORECASE)
+# "2. ve 3. sayfa" gibi sıra sayısı listeleri de alınır; "60 sayfalık" belge uzunluğudur, sayfa değil
+_SAYFA_SONRA = re.compile(r"\b((?:\d+\s*\.\s*(?:,|ve)\s*)*\d+)\s*\.?\s*sayfa(?!l[ıi]k)", re.IGNORECASE)
+# "Soru 12 sayfa 3" içindeki 12 sayfa değil soru numarasıdır
+_SORU_ONCE = re.compile(r"soru\s*(?:no\.?\s*)?$", re.IGNORECASE)
+# Belge boyutu bilinmiyorsa tek aralıktan alınan en fazla sayfa
+_SAYFA_ARALIK_UST = 1000
+
+def parse_page_refs(metin, toplam=None):
+    metin = metin or ""
+    sayfalar = set()
+    for grup in _SAYFA_ONCE.findall(metin):
+        for parca in re.split(r"\s*(?:,|ve)\s*", grup):
+            uclar = [int(x) for x in re.split(r"\s*[-–]\s*", parca) if x]
+            if len(uclar) == 2 and uclar[0] <= uclar[1]:
+                # Aralık üretilmeden önce belge boyutuna kırpılır ("sayfa 1-5000000" bellek/CPU harcamasın)
+                ust = min(uclar[1], toplam if toplam is not None else uclar[0] + _SAYFA_ARALIK_UST - 1)
+                sayfalar.update(range(max(uclar[0], 1), ust + 1))
+            elif uclar:
+                sayfalar.add(uclar[0])
+    for m in _SAYFA_SONRA.finditer(metin):
+        if not _SORU_ONCE.search(metin[:m.start()]):
+            sayfalar.update(int(x) for x in re.findall(r"\d+", m.group(1)))
+    return sorted(p for p in sayfalar if p >= 1 and (toplam is None or p <= toplam))
+
+# pdfium iş parçacığı güvenli değil; tüm belge işlemleri tek kilitten geçer
+_pdfium_kilit = threading.Lock()
+
+# Belge ek deposundaki dosya yolundan açılır (pdfium bayt kopyası istemez); "_" ile başlayan
+# yol st.cache_data tarafından özetlenmez, anahtar belge özetidir
+@st.cache_data(max_entries=32, show_spinner=False)
+def pdf_page_count(doc_hash, _data):
+    with _pdfium_kilit:
+        return len(pdfium.PdfDocument(_data))
+
+def extract_pages(data, pages):
+    with _pdfium_kilit:
+        kaynak = pdfium.PdfDocument(data)
+        yeni = pdfium.PdfDocument.new()
+        yeni.import_pages(kaynak, [p - 1 for p in pages])
+        buf = io.BytesIO()
+        yeni.save(buf)
+    return buf.getvalue()
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def pdf_thumbnail(doc_hash, _data, page, width=220):
+    with _pdfium_kilit:
+        sayfa = pdfium.PdfDocument(_data)[page - 1]
+        img = sayfa.render(scale=width / sayfa.get_width()).to_pil()
+    buf = io.BytesIO()
+    img.convert("RGB").save(buf, format="JPEG", quality=80)
+    return buf.getvalue()
+
+# --- ARKA PLAN İŞLERİ ---
+# Model çağrıları script içinde değil, ortak bir havuzda iş olarak çalışır. Yeniden çalıştırma
+# ya da modüller arası geçiş işi iptal etmez; sonuç hazır olunca oturuma bağlanır. Aynı anahtarlı
+# (aynı model + aynı girdi) bir iş zaten sürüyorsa, hangi oturumdan gelirse gelsin ona bağlanılır.
+class Job:
+    def __init__(self, job_id, key):
+        self.id = job_id
+        self.key = key
+        self.chunks = []
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self._done = threading.Event()
+        self._yapilanlar = set()
+        self._lock = threading.Lock()
+
+    @property
+    def text(self):
+        return "".join(self.chunks)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    # Aynı işe bağlanan her oturum sonucu ayrı işler; kalıcı kayıt gibi yan etkiler hedef başına bir kez yapılır
+    def ilk_kez(self, hedef):
+        with self._lock:
+            if hedef in self._yapilanlar: return False
+            self._yapilanlar.add(hedef)
+            return True
+
+# Toplu işler (çok sayfalı çözüm, staj defteri) ayrı ve küçük bir havuza gider: bir kullanıcının
+# 60 sayfalık işi diğer oturumların tek soru, özet ve sohbet işlerini kuyrukta bekletmez.
+class JobRunner:
+    def __init__(self, workers=8, keep_seconds=900, bulk_workers=4):
+        self.keep_seconds = keep_seconds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="is")
+        self._bulk = ThreadPoolExecutor(max_workers=bulk_workers, thread_name_prefix="toplu")
+        self._jobs = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    # fn(job) işi yapar; akan metni job.chunks'a ekleyebilir, dönüş değeri job.result olur
+    def submit(self, key, fn, bulk=False):
+        with self._lock:
+            self._prune()
+            job = self._inflight.get(key)
+            if job is not None: return job
+            job = Job(os.urandom(8).hex(), key)
+            job.calistirma = aktif_calistirma()
+            self._jobs[job.id] = job
+            self._inflight[key] = job
+        (self._bulk if bulk else self._pool).submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active(self):
+        with self._lock:
+            return len(self._inflight)
+
+    def _run(self, job, fn):
+        # İşin ölçümleri, onu başlatan çalıştırmaya yazılır
+        _olcum_yerel.calistirma = job.calistirma
+        try:
+            job.result = fn(job)
+        except Exception as e:
+            job.error = e
+        finally:
+            job.finished = time.time()
+            with self._lock:
+                self._inflight.pop(job.key, None)
+            job._done.set()
+
+    def _prune(self):
+        sinir = time.time() - self.keep_seconds
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < sinir]:
+            del self._jobs[job_id]
+
+@st.cache_resource
+def is_yoneticisi():
+    return JobRunner(int(ayar("IS_ISCI")), float(ayar("IS_SAKLAMA_SN")), int(ayar("TOPLU_ISCI")))
+
+def akis_isi(akis):
+    def calis(job):
+        for parca in akis: job.chunks.append(parca)
+        return job.text
+    return calis
+
+# Oturum tarafı: her arayüz yuvası (slot) için bekleyen iş ve biten işin işlenmiş sonucu tutulur
+def _bekleyen():
+    return st.session_state.setdefault("bekleyen_isler", {})
+
+def _sonuclar():
+    return st.session_state.setdefault("is_sonuclari", {})
+
+def is_baslat(slot, tur, key, fn, toplu=False, **meta):
+    job = is_yoneticisi().submit(key, fn, bulk=toplu)
+    _bekleyen()[slot] = {"id": job.id, "tur": tur, "meta": meta}
+    _sonuclar().pop(slot, None)
+    return job
+
+def model_isi(slot, tur, inputs, **meta):
+    if not isinstance(inputs, list): inputs = [inputs]
+    key = content_hash([ayar("MODEL_ARKA_UC"), ayar("MODEL_ADI")] + inputs)
+    return is_baslat(slot, tur, key, akis_isi(stream_gemini_response(inputs)), **meta)
+
+# Sohbet turu da iş olarak gider; aynı sohbette aynı tur için ikinci bir çağrı açılmaz
+def sohbet_isi(slot, sohbet, metin, liste):
+    key = content_hash(["sohbet", id(sohbet), len(sohbet.turns), metin])
+    return is_baslat(slot, "sohbet", key, akis_isi(sohbet.send(metin)), liste=liste)
+
+def is_bekliyor(slot):
+    return slot in _bekleyen()
+
+def is_sonucu(slot):
+    return _sonuclar().get(slot)
+
+# Biten işin metnini gösterir; hata ise uyarı olarak gösterip False döner (PDF vb. sunulmaz)
+def sonuc_goster(sonuc):
+    if sonuc.get("hata"):
+        st.error(sonuc["metin"])
+        return False
+    st.markdown(sonuc["metin"])
+    return True
+
+# Her çalıştırmanın başında biten işler türüne göre işlenip oturuma bağlanır
+def isleri_topla():
+    bekleyen = _bekleyen()
+    for slot, kayit in list(bekleyen.items()):
+        job = is_yoneticisi().get(kayit["id"])
+        if job is not None and not job.done: continue
+        del bekleyen[slot]
+        if job is None: continue
+        sonuc = job.result if job.error is None else hata_metni(job.error)
+        isleyici = IS_ISLEYICILERI.get(kayit["tur"])
+        deger = isleyici(sonuc, kayit["meta"], job) if isleyici else sonuc
+        if deger is not None: _sonuclar()[slot] = deger
+
+# Bekleyen işin akan metnini canlı gösterir; iş bitince tüm sayfayı yeniden çalıştırır
+@st.fragment(run_every=0.5)
+def is_paneli(slot, sohbet=False):
+    kayit = _bekleyen().get(slot)
+    job = is_yoneticisi().get(kayit["id"]) if kayit else None
+    if job is None or job.done:
+        st.rerun()
+    metin = job.text.partition(FORMUL_AYRACI)[0]
+    hedef = st.chat_message("assistant") if sohbet else st.container()
+    hedef.markdown((metin or "⏳ Yapay Zeka çalışıyor...") + " ▌")
+
+# Biten işin türüne göre oturuma bağlanması; dönen değer yuvanın sonucu olarak saklanır
+def _kayit_bitti(sonuc, meta, job):
+    # Hata metni çözüm/özet olarak kaydedilmez
+    if hata_mi(sonuc): return {"metin": sonuc, "hata": True, "formul": False, **meta}
+    depo = ders_deposu()
+    # Aynı isteği gönderen iki sekme tek işe bağlanır; derse bir kez yazılır
+    yaz = job.ilk_kez((meta["alan"], meta["ders"], meta["kayit"]))
+    if meta["kayit"] != "soru":
+        if yaz: depo.add(meta["alan"], meta["ders"], meta["kayit"], sonuc, baslik=meta.get("baslik", ""))
+        return {"metin": sonuc, **meta}
+    cozum, ayrac, formuller = sonuc.partition(FORMUL_AYRACI)
+    if yaz:
+        depo.add(meta["alan"], meta["ders"], "soru", cozum, baslik=meta.get("baslik", ""))
+        if ayrac: depo.add(meta["alan"], meta["ders"], "formul", formuller.strip(), baslik=meta.get("baslik", ""))
+    return {"metin": cozum, "formul": bool(ayrac), **meta}
+
+def _toplu_bitti(sonuc, meta, job):
+    cozum, formuller = sonuc if isinstance(sonuc, tuple) else (sonuc, "")
+    if not hata_mi(cozum) and job.ilk_kez((meta["alan"], meta["ders"])):
+        depo = ders_deposu()
+        depo.add(meta["alan"], meta["ders"], "soru", cozum, baslik=meta["etiket"])
+        if formuller: depo.add(meta["alan"], meta["ders"], "formul", formuller, baslik=meta["etiket"])
+    _sonuclar().setdefault(meta["grup"], {"toplam": 0, "bitenler": []})["bitenler"].append((meta["etiket"], cozum))
+
+def _analiz_bitti(sonuc, meta, job):
+    if hata_mi(sonuc): return {"metin": sonuc, "hata": True}
+    st.session_state.analiz_msgs = [{"role": "assistant", "content": sonuc}]
+    # Takip soruları için çizim bir kez yüklenir, sonraki turlarda referansla gider. attach yalnızca
+    # referans saklar; bu işleyici kenar çubuğundaki anahtar okunmadan çalıştığından model_hazir'e bakılmaz
+    sohbet = yeni_sohbet(f"Ekteki teknik resim için '{meta['mod']}' modunda bir rapor hazırladın. Kullanıcının sorularını bu rapor ve çizim bağlamında yanıtla.", sonuc)
+    sohbet.attach(meta["cizim"])
+    st.session_state.analiz_sohbet = sohbet
+
+def _sohbet_bitti(sonuc, meta, job):
+    # Hata metni sohbet geçmişine asistan mesajı olarak yazılmaz, yuvada uyarı olarak kalır
+    if hata_mi(sonuc): return {"metin": sonuc, "hata": True}
+    st.session_state.setdefault(meta["liste"], []).append({"role": "assistant", "content": sonuc})
+
+def _defter_bitti(sonuc, meta, job):
+    # İşin kendisi çöktüyse metin döner; aksi halde gün gün sonuç listesi
+    if isinstance(sonuc, str): return {"metin": sonuc, "hata": True}
+    return {"sayfalar": sonuc, "hata": False}
+
+IS_ISLEYICILERI = {
+    "metin": lambda sonuc, meta, job: {"metin": sonuc, "hata": hata_mi(sonuc), **meta},
+    "kayit": _kayit_bitti,
+    "toplu": _toplu_bitti,
+    "analiz": _analiz_bitti,
+    "sohbet": _sohbet_bitti,
+    "defter": _defter_bitti,
+}
+
+# --- TOPLU ÇÖZÜM ---
+# Dakikadaki istek sınırı için jeton kovası: kova dolunca bir dakikalık kota bir anda
+# kullanılabilir, sonra jetonlar saniyede rpm/60 hızla dolar. Kota API anahtarına bağlı
+# olduğundan süreç genelinde tek kova kullanılır; dayanıklı çağrı katmanı her denemede jeton alır.
+class RateLimiter:
+    def __init__(self, rpm):
+        self.rate = rpm / 60.0
+        self.capacity = max(rpm, 1.0)
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if self.rate <= 0: return
+        with self._lock:
+            simdi = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (simdi - self._last) * self.rate)
+            self._last = simdi
+            self._tokens -= 1
+            bekle = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if bekle: time.sleep(bekle)
+
+@st.cache_resource(show_spinner=False)
+def istek_sinirlayici():
+    return RateLimiter(float(ayar("DAKIKA_ISTEK_LIMITI")))
+
+# Toplu görevler ayrıca kendi payından jeton alır; kalan pay etkileşimli çağrılara kalır
+@st.cache_resource(show_spinner=False)
+def toplu_sinirlayici():
+    return RateLimiter(float(ayar("DAKIKA_ISTEK_LIMITI")) * float(ayar("TOPLU_KOTA_ORANI")))
+
+# Yüklenen dosyaları görevlere böler: her görsel bir görev, PDF'nin her sayfası ayrı bir görev
+def toplu_gorevler(dosyalar):
+    gorevler = []
+    for f in dosyalar:
+        parca = dosya_girdisi(f)
+        if parca["mime_type"] != "application/pdf":
+            gorevler.append((f.name, parca))
+            continue
+        for p in range(1, pdf_page_count(parca["ek"], ek_deposu().path(parca["ek"])) + 1):
+            gorevler.append((f"{f.name} · Sayfa {p}", sayfa_eki(parca, (p,))))
+    return gorevler
+
+def toplu_coz(ders_adi, etiket, parca):
+    prompt = f"""
+    Ders: {ders_adi}. Kaynak: {etiket}.
+    GÖREVLER:
+    1. Ekteki sayfadaki/görseldeki her soruyu ayrı başlıkla (Örn: **Soru 4 Çözümü:**) adım adım çöz.
+    2. Çözümün en altına '{FORMUL_AYRACI}' başlığı at ve kullanılan formülleri listele.
+    """
+    toplu_sinirlayici().wait()
+    # Yeniden deneme, yedek modele geçiş ve istek sınırı dayanıklı çağrı katmanında
+    yanit = get_gemini_response([prompt, parca])
+    if hata_mi(yanit): return yanit, ""
+    cozum, _, formuller = yanit.partition(FORMUL_AYRACI)
+    return cozum.strip(), formuller.strip()
+
+# Tamamlanan görev oldukça sayfa yenilenir; sonuçlar tamamlanma sırasıyla derse yazılır
+@st.fragment(run_every=0.5)
+def toplu_paneli(grup):
+    durum = _sonuclar().get(grup, {"toplam": 0, "bitenler": []})
+    bekleyen = [k for s, k in _bekleyen().items() if s.startswith(grup + "_")]
+    isler = [is_yoneticisi().get(k["id"]) for k in bekleyen]
+    if not bekleyen or any(j is None or j.done for j in isler):
+        st.rerun()
+    bitti = len(durum["bitenler"])
+    st.progress(bitti / max(durum["toplam"], 1), text=f"{bitti}/{durum['toplam']} tamamlandı · {time.time() - durum.get('baslangic', time.time()):.1f} sn")
+
+def toplu_cozum_arayuzu(depo, alan, ders_adi):
+    dosyalar = st.file_uploader("Sorular (birden çok resim veya çok sayfalı PDF)", type=["jpg", "png", "pdf"],
+                                accept_multiple_files=True, key=f"toplu_up_{ders_adi}")
+    grup = f"toplu_{ders_adi}"
+    calisiyor = any(s.startswith(grup + "_") for s in _bekleyen())
+    if dosyalar:
+        gorevler = toplu_gorevler(dosyalar)
+        st.caption(f"{len(gorevler)} görev · en fazla {ayar('TOPLU_ISCI')} paralel · dakikada {ayar('DAKIKA_ISTEK_LIMITI')} istek")
+        if st.button("Hepsini Çöz ve Kaydet", key=f"toplu_btn_{ders_adi}", type="primary", disabled=calisiyor):
+            if not model_hazir():
+                st.error("API Anahtarı eksik.")
+                return
+            _sonuclar()[grup] = {"toplam": len(gorevler), "bitenler": [], "baslangic": time.time()}
+            for i, (etiket, parca) in enumerate(gorevler):
+                anahtar = content_hash(["toplu", ayar("MODEL_ARKA_UC"), ayar("MODEL_ADI"), ders_adi, etiket, parca])
+                is_baslat(f"{grup}_{i}", "toplu", anahtar, lambda job, e=etiket, p=parca: toplu_coz(ders_adi, e, p),
+                          toplu=True, alan=alan, ders=ders_adi, etiket=etiket, grup=grup)
+            calisiyor = True
+    if calisiyor: toplu_paneli(grup)
+    for etiket, cozum in _sonuclar().get(grup, {}).get("bitenler", []):
+        if hata_mi(cozum): st.error(f"{etiket}: {cozum}")
+        else:
+            with st.expander(f"✅ {etiket}"): st.markdown(cozum)
+
+# --- PARALEL ALT ÇAĞRILAR ---
+# Tek bir işin birden çok model çağrısına yayılması (tam rapor, toplu defter). Alt çağrılar iş
+# havuzunda değil ayrı bir havuzda çalışır; iş, kendi alt çağrılarını beklerken havuzu tıkamaz.
+@st.cache_resource(show_spinner=False)
+def alt_is_havuzu():
+    return ThreadPoolExecutor(max_workers=int(ayar("ALT_ISCI")), thread_name_prefix="alt")
+
+# Toplu defterin günleri ayrı, TOPLU_ISCI ile sınırlı havuzda çevrilir; tam rapor bunların arkasında kalmaz
+@st.cache_resource(show_spinner=False)
+def toplu_alt_havuzu():
+    return ThreadPoolExecutor(max_workers=int(ayar("TOPLU_ISCI")), thread_name_prefix="toplu_alt")
+
+# Sonuçlar bittikçe (sıra, sonuç) olarak döner; ölçümler işi başlatan çalıştırmaya yazılır
+def paralel(fonksiyonlar, havuz=None):
+    calistirma = aktif_calistirma()
+    def calis(fn):
+        _olcum_yerel.calistirma = calistirma
+        return fn()
+    havuz = havuz or alt_is_havuzu()
+    gelecekler = {havuz.submit(calis, fn): i for i, fn in enumerate(fonksiyonlar)}
+    for g in as_completed(gelecekler):
+        yield gelecekler[g], g.result()
+
+# --- TAM ANALİZ RAPORU ---
+ANALIZ_MODLARI = ["Genel Kontrol", "İmalat (CAM)", "Malzeme Seçimi", "Maliyet Analizi"]
+TAM_RAPOR = "Tam Rapor (4 mod)"
+
+def analiz_istegi(mod, cizim):
+    return [f"Bu dosyayı '{mod}' modunda analiz et. Profesyonel rapor yaz.", cizim]
+
+# Dört mod aynı çizim üzerinde aynı anda çalışır ve sabit sırada tek rapora birleşir.
+# Her bölüm tek mod analiziyle aynı istektir; önbellek iki yol arasında ortaktır.
+def tam_rapor(cizim, job=None):
+    bolumler = {}
+    for i, metin in paralel([lambda m=m: get_gemini_response(analiz_istegi(m, cizim)) for m in ANALIZ_MODLARI]):
+        bolumler[i] = metin
+        if job is not None: job.chunks[:] = [f"⏳ {len(bolumler)}/{len(ANALIZ_MODLARI)} bölüm hazır · son: {ANALIZ_MODLARI[i]}"]
+    if all(hata_mi(m) for m in bolumler.values()): return bolumler[0]
+    rapor = ["# Teknik Resim Tam Raporu"]
+    for i, mod in enumerate(ANALIZ_MODLARI):
+        metin = bolumler[i]
+        rapor.append(f"## {i + 1}. {mod}\n\n" + (f"_Bu bölüm hazırlanamadı: {metin}_" if hata_mi(metin) else metin.strip()))
+    return "\n\n".join(rapor)
+
+# --- TOPLU STAJ DEFTERİ ---
+# Günlük notların tarihi dosya adından okunur: 2025-07-14_cnc.txt, 20250714.jpg, 14.07.2025 kaynak.pdf
+NOT_UZANTILARI = (".txt", ".md", ".jpg", ".jpeg", ".png", ".pdf")
+_NOT_METIN = (".txt", ".md")
+_TARIH_YGA = re.compile(r"(?<!\d)(20\d\d)[-_.]?(\d\d)[-_.]?(\d\d)(?!\d)")
+_TARIH_GAY = re.compile(r"(?<!\d)(\d{1,2})[-_.](\d{1,2})[-_.](20\d\d)(?!\d)")
+
+def not_tarihi(ad):
+    kok = os.path.splitext(os.path.basename(ad))[0]
+    for desen, sira in ((_TARIH_YGA, (1, 2, 3)), (_TARIH_GAY, (3, 2, 1))):
+        for m in desen.finditer(kok):
+            try: tarih = date(*(int(m.group(i)) for i in sira))
+            except ValueError: continue
+            konu = re.sub(r"[-_]+", " ", kok[:m.start()] + " " + kok[m.end():]).strip(" .")
+            return tarih, " ".join(konu.split())
+    return None, kok
+
+# Başsız kullanım için dosya -> not parçası (metin ya da ek referansı); arayüz dosya_girdisi'ni kullanır
+def not_parcasi(ad, data):
+    uzanti = os.path.splitext(ad)[1].lower()
+    if uzanti in _NOT_METIN: return data.decode("utf-8", errors="replace")
+    return ek_olustur(data, mimetypes.guess_type(ad)[0] or "image/jpeg")
+
+# Aynı güne ait notlar (ör. yazılı not + fotoğraf) tek sayfada birleşir; tarihsiz dosyalar ayrıca döner
+def staj_gunleri(notlar):
+    gunler, tarihsiz = {}, []
+    for ad, parca in notlar:
+        tarih, konu = not_tarihi(ad)
+        if tarih is None:
+            tarihsiz.append(ad)
+            continue
+        gun = gunler.setdefault(tarih, {"tarih": tarih, "konular": [], "parcalar": []})
+        if konu and konu not in gun["konular"]: gun["konular"].append(konu)
+        gun["parcalar"].append(parca)
+    return [gunler[t] for t in sorted(gunler)], tarihsiz
+
+def gun_basligi(gun):
+    return " - ".join(filter(None, [str(gun["tarih"]), ", ".join(gun["konular"])]))
+
+# Tek günlük çeviriyle aynı istek: daha önce tek tek çevrilen günler önbellekten gelir
+def staj_gunu(gun):
+    prompt = f"Staj notunu teknik dille, edilgen çatıda (yapıldı, edildi) yaz. Tarih: {gun['tarih']}, Konu: {', '.join(gun['konular'])}."
+    notlar = [p for p in gun["parcalar"] if isinstance(p, str)]
+    if notlar: prompt += "\nNotlar: " + "\n".join(notlar)
+    toplu_sinirlayici().wait()
+    return get_gemini_response([prompt] + [p for p in gun["parcalar"] if not isinstance(p, str)])
+
+# Günler paralel çevrilir, sonuç tarih sırasıyla döner; ilerleme(biten, toplam) isteğe bağlı
+def staj_defteri(gunler, ilerleme=None):
+    sayfalar = [None] * len(gunler)
+    for biten, (i, metin) in enumerate(paralel([lambda g=g: staj_gunu(g) for g in gunler], toplu_alt_havuzu()), 1):
+        sayfalar[i] = {"baslik": gun_basligi(gunler[i]), "metin": metin, "hata": hata_mi(metin)}
+        if ilerleme: ilerleme(biten, len(gunler))
+    return sayfalar
+
+# Tek, kesintisiz defter metni; yazılamayan günler dışarıda kalır
+def defter_metni(sayfalar):
+    return "\n\n".join(f"{s['baslik']}\n\n{s['metin']}" for s in sayfalar if not s["hata"])
+
+def staj_toplu_arayuzu():
+    dosyalar = st.file_uploader("Günlük notlar (dosya adında tarih olmalı: 2025-07-14_cnc.txt, 15.07.2025.jpg)",
+                                type=[u[1:] for u in NOT_UZANTILARI], accept_multiple_files=True, key="staj_toplu_up")
+    if dosyalar:
+        gunler, tarihsiz = staj_gunleri([
+            (f.name, f.getvalue().decode("utf-8", errors="replace") if f.name.lower().endswith(_NOT_METIN) else dosya_girdisi(f))
+            for f in dosyalar
+        ])
+        if tarihsiz: st.warning("Tarihi okunamadığı için atlandı: " + ", ".join(tarihsiz))
+        if gunler:
+            st.caption(f"{len(gunler)} gün · {gunler[0]['tarih']} → {gunler[-1]['tarih']} · en fazla {ayar('TOPLU_ISCI')} paralel")
+        if gunler and st.button("Defteri Oluştur", type="primary", disabled=is_bekliyor("staj_defter")):
+            if not model_hazir():
+                st.error("API Anahtarı eksik.")
+                return
+            anahtar = content_hash(["staj_defter", ayar("MODEL_ARKA_UC"), ayar("MODEL_ADI")] +
+                                   [[str(g["tarih"]), g["konular"], g["parcalar"]] for g in gunler])
+            def calis(job):
+                def ilerleme(biten, toplam): job.chunks[:] = [f"⏳ {biten}/{toplam} gün yazıldı"]
+                return staj_defteri(gunler, ilerleme)
+            is_baslat("staj_defter", "defter", anahtar, calis, toplu=True)
+
+    if is_bekliyor("staj_defter"): is_paneli("staj_defter")
+    elif sonuc := is_sonucu("staj_defter"):
+        if sonuc["hata"]:
+            st.error(sonuc["metin"])
+            return
+        sayfalar = sonuc["sayfalar"]
+        for s in sayfalar:
+            if s["hata"]: st.error(f"{s['baslik']}: {s['metin']}")
+        tamam = [s for s in sayfalar if not s["hata"]]
+        st.success(f"{len(tamam)}/{len(sayfalar)} gün yazıldı")
+        if tamam: pdf_indir("Staj Defterini PDF İndir", lambda: create_pdf(defter_metni(sayfalar)), "Staj_Defteri.pdf")
+        for s in tamam:
+            with st.expander(s["baslik"]): st.markdown(s["metin"])
 
 # ==================================================
 # MODÜL 1: DERS ASİSTANI
 # ==================================================
 def sayfa_ders_asistani():
-    if "dersler" not in st.session_state: st.session_state.dersler = {} 
+    depo = ders_deposu()
+    alan = calisma_alani()
     if "aktif_ders_sekmesi" not in st.session_state: st.session_state.aktif_ders_sekmesi = "➕ Yeni Ders"
+    # Kodla yapılan sekme geçişi: anahtarlı sekme çubuğu, widget oluşturulmadan önce güncellenmeli
+    if "sekme_git" in st.session_state:
+        st.session_state.aktif_ders_sekmesi = st.session_state.nav_radio = st.session_state.pop("sekme_git")
 
-    mevcut_dersler = list(st.session_state.dersler.keys())
+    mevcut_dersler = depo.courses(alan)
     sekme_secenekleri = mevcut_dersler + ["➕ Yeni Ders"]
     try: secili_index = sekme_secenekleri.index(st.session_state.aktif_ders_sekmesi)
     except ValueError: secili_index = len(sekme_secenekleri) - 1
@@ -181,11 +2101,10 @@ def sayfa_ders_asistani():
         col1, col2 = st.columns([3, 1])
         yeni_isim = col1.text_input("Ders Adı", placeholder="Örn: Akışkanlar Mekaniği")
         if col2.button("Dersi Ekle ve Git", use_container_width=True):
-            if yeni_isim and yeni_isim not in st.session_state.dersler:
-                st.session_state.dersler[yeni_isim] = {'sorular': [], 'formuller': []}
-                st.session_state.aktif_ders_sekmesi = yeni_isim
+            if yeni_isim and depo.add_course(alan, yeni_isim):
+                st.session_state.sekme_git = yeni_isim
                 st.rerun()
-            elif yeni_isim in st.session_state.dersler: st.warning("Bu ders zaten var.")
+            elif yeni_isim: st.warning("Bu ders zaten var.")
 
     else:
         ders_adi = st.session_state.aktif_ders_sekmesi
@@ -195,21 +2114,38 @@ def sayfa_ders_asistani():
             # EKLENEN: Konu Özeti Seçeneği
             ozellik = st.radio("Araçlar", ["Soru Çözücü", "Konu Özeti", "Formül Defteri", "Örnek Sınav"], key=f"rad_{ders_adi}")
             st.markdown("---")
+            sorgu = st.text_input("🔎 Derste Ara", key=f"ara_{ders_adi}", placeholder="Örn: Bernoulli, moment")
+            st.markdown("---")
             if st.button(f"Dersi Sil", key=f"del_{ders_adi}"):
-                del st.session_state.dersler[ders_adi]
-                st.session_state.aktif_ders_sekmesi = "➕ Yeni Ders"
+                depo.delete_course(alan, ders_adi)
+                st.session_state.sekme_git = "➕ Yeni Ders"
                 st.rerun()
 
         with col_sag:
             
+            # --- ARAMA SONUÇLARI ---
+            if sorgu:
+                t0 = time.perf_counter()
+                sonuclar = depo.search(alan, ders_adi, sorgu)
+                st.caption(f"{len(sonuclar)} sonuç · {(time.perf_counter() - t0) * 1000:.1f} ms")
+                for k in sonuclar:
+                    with st.expander(f"{KAYIT_TURLERI.get(k['tur'], k['tur'])}: {k['baslik'] or k['parca'][:80]}"):
+                        st.markdown(k["parca"])
+                        if k["tur"] == "formul": st.code(k["icerik"])
+                        else: st.markdown(k["icerik"])
+                st.markdown("---")
+            
             # --- 1. SORU ÇÖZÜCÜ (GELİŞTİRİLMİŞ) ---
             if ozellik == "Soru Çözücü":
                 st.info("Sorunun fotoğrafını yükleyin veya kamerayla çekin. Yapay Zeka hangi soruyu çözdüğünü belirterek anlatsın.")
                 
                 # İki seçenekli yükleme: Dosya veya Kamera
-                kaynak_turu = st.radio("Görsel Kaynağı", ["Dosya Yükle (Resim/PDF)", "Kamera ile Çek"], horizontal=True, label_visibility="collapsed")
+                kaynak_turu = st.radio("Görsel Kaynağı", ["Dosya Yükle (Resim/PDF)", "Kamera ile Çek", "Toplu Çözüm"], horizontal=True, label_visibility="collapsed")
                 
                 q_file = None
+                if kaynak_turu == "Toplu Çözüm":
+                    toplu_cozum_arayuzu(depo, alan, ders_adi)
+                    return
                 if kaynak_turu == "Dosya Yükle (Resim/PDF)":
                     q_file = st.file_uploader("Dosya Seç", type=["jpg", "png", "pdf"], key=f"up_{ders_adi}", label_visibility="collapsed")
                 else:
@@ -219,40 +2155,49 @@ def sayfa_ders_asistani():
                 hangi_soru = st.text_input("Hangi soruyu çözeyim?", placeholder="Örn: Sayfa 3, Soru 5 (Boş bırakırsan hepsini analiz ederim)")
 
                 if q_file:
-                    input_data = None
-                    # Veri tipi kontrolü (Kamera veya Dosya)
-                    if hasattr(q_file, 'type') and q_file.type == "application/pdf":
+                    # Veri tipi kontrolü (Kamera veya Dosya); resim ön işlenmiş haliyle önizlenir
+                    input_data = dosya_girdisi(q_file)
+                    sayfa_notu = ""
+                    if input_data["mime_type"] == "application/pdf":
                          st.success("📄 PDF Algılandı")
-                         input_data = {"mime_type": "application/pdf", "data": q_file.getvalue()}
+                         # Tüm belge yerine yalnızca istenen sayfalar gönderilir
+                         belge = input_data["ek"]
+                         yol = ek_deposu().path(belge)
+                         toplam = pdf_page_count(belge, yol)
+                         onerilen = parse_page_refs(hangi_soru, toplam)
+                         secili = st.multiselect(f"Gönderilecek sayfalar (toplam {toplam})", list(range(1, toplam + 1)), default=onerilen,
+                                                 key=f"sayfa_{ders_adi}_{belge[:12]}_{'-'.join(map(str, onerilen))}",
+                                                 placeholder="Boş bırakırsan tüm belge gönderilir")
+                         if secili and len(secili) < toplam:
+                             secili = sorted(secili)
+                             kolonlar = st.columns(min(len(secili), 4))
+                             for k, p in zip(kolonlar, secili[:4]):
+                                 k.image(pdf_thumbnail(belge, yol, p), caption=f"Sayfa {p}")
+                             input_data = sayfa_eki(input_data, tuple(secili))
+                             sayfa_notu = f"Ekteki PDF, orijinal belgenin yalnızca {', '.join(map(str, secili))} numaralı sayfalarını sırasıyla içerir; sayfa numaralarını orijinal belgeye göre yaz."
                     else:
-                         # Resim (Kamera veya Upload)
-                         img = Image.open(q_file)
-                         st.image(img, width=400)
-                         input_data = img
-
-                    if st.button("Çöz ve Kaydet", key=f"solve_{ders_adi}", type="primary"):
-                        if api_key:
-                            with st.spinner("Yapay Zeka soruyu analiz ediyor..."):
-                                prompt = f"""
-                                Ders: {ders_adi}.
-                                KULLANICI İSTEĞİ: {hangi_soru if hangi_soru else "Görünen soruları analiz et."}
-                                
-                                GÖREVLER:
-                                1. Önce hangi sayfadaki hangi soruyu çözdüğünü net bir şekilde yaz (Örn: **Sayfa 2, Soru 4 Çözümü:**).
-                                2. Soruyu adım adım, bir öğrenciye anlatır gibi çöz.
-                                3. Çözümün en altına '---FORMÜLLER---' başlığı at ve bu soruda kullanılan formülleri listele.
-                                """
-                                res = get_gemini_response([prompt, input_data])
-                                
-                                parts = res.split("---FORMÜLLER---")
-                                st.markdown(parts[0])
-                                st.session_state.dersler[ders_adi]['sorular'].append(parts[0])
-                                
-                                if len(parts) > 1:
-                                    st.session_state.dersler[ders_adi]['formuller'].append(parts[1].strip())
-                                    st.success("Formüller kaydedildi.")
+                         st.image(ek_baytlari(input_data), width=400)
+
+                    if st.button("Çöz ve Kaydet", key=f"solve_{ders_adi}", type="primary", disabled=is_bekliyor(f"soru_{ders_adi}")):
+                        if model_hazir():
+                            prompt = f"""
+                            Ders: {ders_adi}.
+                            KULLANICI İSTEĞİ: {hangi_soru if hangi_soru else "Görünen soruları analiz et."}
+                            {sayfa_notu}
+                            
+                            GÖREVLER:
+                            1. Önce hangi sayfadaki hangi soruyu çözdüğünü net bir şekilde yaz (Örn: **Sayfa 2, Soru 4 Çözümü:**).
+                            2. Soruyu adım adım, bir öğrenciye anlatır gibi çöz.
+                            3. Çözümün en altına '---FORMÜLLER---' başlığı at ve bu soruda kullanılan formülleri listele.
+                            """
+                            # Çözüm arka planda canlı akar, formül kısmı iş bitince ayrılıp kaydedilir
+                            model_isi(f"soru_{ders_adi}", "kayit", [prompt, input_data], alan=alan, ders=ders_adi, kayit="soru", baslik=hangi_soru)
                         else: st.error("API Anahtarı eksik.")
 
+                if is_bekliyor(f"soru_{ders_adi}"): is_paneli(f"soru_{ders_adi}")
+                elif sonuc := is_sonucu(f"soru_{ders_adi}"):
+                    if sonuc_goster(sonuc) and sonuc["formul"]: st.success("Formüller kaydedildi.")
+
             # --- 2. KONU ÖZETİ (YENİ EKLENDİ) ---
             elif ozellik == "Konu Özeti":
                 st.subheader("📚 Akıllı Konu Özeti")
@@ -269,42 +2214,55 @@ def sayfa_ders_asistani():
                     konu_basligi = st.text_input("Konu Başlığı (Opsiyonel)", placeholder="Örn: Bu notların özeti")
                     ozet_dosya = st.file_uploader("Not Dosyası", type=["pdf", "jpg", "png"], key=f"ozet_up_{ders_adi}")
 
-                if st.button("Özetle", key=f"ozet_btn_{ders_adi}", type="primary"):
-                    with st.spinner("Özetleniyor..."):
-                        prompt = f"Ders: {ders_adi}. Konu: {konu_basligi}. Bu konuyu/dokümanı bir mühendislik öğrencisi için özetle. Ana kavramları, önemli formülleri ve dikkat edilmesi gereken noktaları maddeler halinde yaz."
-                        
-                        inputs = [prompt]
-                        if ozet_dosya:
-                             if ozet_dosya.type == "application/pdf":
-                                 inputs.append({"mime_type": "application/pdf", "data": ozet_dosya.getvalue()})
-                             else:
-                                 inputs.append(Image.open(ozet_dosya))
-                        
-                        res = get_gemini_response(inputs)
-                        st.markdown(res)
-                        st.download_button("Özeti PDF İndir", create_pdf(res), "Ozet.pdf")
+                if st.button("Özetle", key=f"ozet_btn_{ders_adi}", type="primary", disabled=is_bekliyor(f"ozet_{ders_adi}")):
+                    prompt = f"Ders: {ders_adi}. Konu: {konu_basligi}. Bu konuyu/dokümanı bir mühendislik öğrencisi için özetle. Ana kavramları, önemli formülleri ve dikkat edilmesi gereken noktaları maddeler halinde yaz."
+                    
+                    inputs = [prompt]
+                    if ozet_dosya:
+                         inputs.append(dosya_girdisi(ozet_dosya))
+                    
+                    model_isi(f"ozet_{ders_adi}", "kayit", inputs, alan=alan, ders=ders_adi, kayit="ozet", baslik=konu_basligi)
+
+                if is_bekliyor(f"ozet_{ders_adi}"): is_paneli(f"ozet_{ders_adi}")
+                elif sonuc := is_sonucu(f"ozet_{ders_adi}"):
+                    if sonuc_goster(sonuc): pdf_indir("Özeti PDF İndir", lambda: create_pdf(sonuc["metin"]), "Ozet.pdf")
 
 
             # --- 3. FORMÜL DEFTERİ ---
             elif ozellik == "Formül Defteri":
                 st.subheader("Kayıtlı Formüller")
-                flist = st.session_state.dersler[ders_adi]['formuller']
-                if flist:
-                    for f in flist: st.code(f)
-                    st.download_button("PDF İndir", create_pdf("\n".join(flist)), "Formuller.pdf")
+                if depo.formula_count(alan, ders_adi):
+                    filtre = st.text_input("Süz", key=f"fsuz_{ders_adi}", placeholder="Sembol (örn: sigma) veya metin (örn: Bernoulli)").strip()
+                    adet = depo.formula_count(alan, ders_adi, filtre)
+                    boyut = int(ayar("SAYFA_BOYUTU"))
+                    son_sayfa = max((adet - 1) // boyut + 1, 1)
+                    sayfa = st.number_input(f"Sayfa (toplam {son_sayfa})", 1, son_sayfa, 1, key=f"fsayfa_{ders_adi}_{filtre}") if son_sayfa > 1 else 1
+                    st.caption(f"{adet} tekil formül")
+                    # Tek tablo: sayfa ne kadar büyük olursa olsun tek bir öğe çizilir
+                    st.dataframe([{"Formül": f["metin"], "Açıklama": f["aciklama"], "Semboller": f["semboller"],
+                                   "Soru": f["adet"], "Kaynak": f["kaynaklar"] or ""}
+                                  for f in depo.formulas(alan, ders_adi, filtre, boyut, (sayfa - 1) * boyut)], hide_index=True)
+                    # Satırlar ilk görülme sırasında olduğundan yeni formül yalnızca son PDF bloğunu değiştirir
+                    pdf_indir("PDF İndir", lambda: create_notebook_pdf(
+                        [f"{f['aciklama']}: {f['metin']}" if f["aciklama"] else f["metin"] for f in depo.formulas(alan, ders_adi, filtre)]), "Formuller.pdf")
                 else: st.warning("Henüz kayıtlı formül yok.")
 
             # --- 4. ÖRNEK SINAV ---
             elif ozellik == "Örnek Sınav":
                 st.subheader("Deneme Sınavı")
-                if st.button("Sınav Hazırla", key=f"ex_{ders_adi}"):
-                    hist = str(st.session_state.dersler[ders_adi]['sorular'])[:2500]
-                    if not hist: st.warning("Önce soru çözdürmelisiniz.")
+                konu = st.text_input("Konu (opsiyonel)", key=f"sinav_konu_{ders_adi}", placeholder="Boş bırakırsan tüm dersten sorulur")
+                if st.button("Sınav Hazırla", key=f"ex_{ders_adi}", disabled=is_bekliyor(f"sinav_{ders_adi}")):
+                    baglam, secilen = sinav_baglami(alan, ders_adi, konu)
+                    if not secilen: st.warning("Önce soru çözdürmelisiniz." if not konu else "Bu konuda kayıt bulunamadı.")
                     else:
-                        with st.spinner("Hazırlanıyor..."):
-                            res = get_gemini_response(f"Ders: {ders_adi}. 4 soru yaz. Cevap verme. {hist}")
-                            st.markdown(res)
-                            st.download_button("Sınav PDF", create_pdf(res), "Sinav.pdf")
+                        st.caption(f"Bağlam: {len(secilen)} kayıt · ≈{estimate_tokens(baglam)} token")
+                        konu_notu = f"Konu: {konu}. " if konu else ""
+                        model_isi(f"sinav_{ders_adi}", "kayit", f"Ders: {ders_adi}. {konu_notu}Aşağıdaki ders kayıtlarına dayanarak 4 soru yaz. Cevap verme.\n\n{baglam}",
+                                  alan=alan, ders=ders_adi, kayit="sinav", baslik=konu)
+
+                if is_bekliyor(f"sinav_{ders_adi}"): is_paneli(f"sinav_{ders_adi}")
+                elif sonuc := is_sonucu(f"sinav_{ders_adi}"):
+                    if sonuc_goster(sonuc): pdf_indir("Sınav PDF", lambda: create_pdf(sonuc["metin"]), "Sinav.pdf")
 
 # ==================================================
 # MODÜL 2: TEKNİK RESİM ANALİZİ
@@ -318,36 +2276,39 @@ def sayfa_analiz():
         f = st.file_uploader("Dosya Yükle", type=["jpg", "png", "pdf"])
         if f:
              with st.expander("Önizleme", expanded=False):
-                 if f.type != "application/pdf": st.image(Image.open(f))
+                 if f.type != "application/pdf": st.image(ek_baytlari(dosya_girdisi(f, document=False)))
                  else: st.info("PDF Yüklendi")
     with c2:
-        m = st.selectbox("Mod", ["Genel Kontrol", "İmalat (CAM)", "Malzeme Seçimi", "Maliyet Analizi"])
-        if f and st.button("Analizi Başlat", type="primary", use_container_width=True):
-            c = [f"Bu dosyayı '{m}' modunda analiz et. Profesyonel rapor yaz."]
-            if f.type == "application/pdf": c.append({"mime_type": "application/pdf", "data": f.getvalue()})
-            else: c.append(Image.open(f))
-            with st.spinner("Yapay Zeka dosyayı inceliyor..."):
-                resp = get_gemini_response(c)
-                st.session_state.analiz_msgs = [{"role": "assistant", "content": resp}]
-                st.rerun()
+        m = st.selectbox("Mod", ANALIZ_MODLARI + [TAM_RAPOR])
+        # Çift tıklama ya da başka bir widget'a dokunmak analizi tekrarlamaz veya yarıda kesmez
+        if f and st.button("Analizi Başlat", type="primary", use_container_width=True, disabled=is_bekliyor("analiz")):
+            cizim = dosya_girdisi(f, document=False)
+            if m == TAM_RAPOR:
+                anahtar = content_hash(["tam_rapor", ayar("MODEL_ARKA_UC"), ayar("MODEL_ADI"), cizim])
+                is_baslat("analiz", "analiz", anahtar, lambda job: tam_rapor(cizim, job), mod=m, cizim=cizim)
+            else:
+                model_isi("analiz", "analiz", analiz_istegi(m, cizim), mod=m, cizim=cizim)
 
-    if st.session_state.analiz_msgs:
+    if is_bekliyor("analiz"):
+        st.divider()
+        is_paneli("analiz")
+    elif (hata := is_sonucu("analiz")) and hata.get("hata"):
+        st.error(hata["metin"])
+    elif st.session_state.analiz_msgs:
         st.divider()
         for msg in st.session_state.analiz_msgs:
             st.markdown(msg["content"])
             if msg == st.session_state.analiz_msgs[0]:
-                st.download_button("Raporu PDF İndir", create_pdf(msg["content"]), "Rapor.pdf", "application/pdf")
-        if prompt := st.chat_input("Raporla ilgili soru sor..."):
+                pdf_indir("Raporu PDF İndir", lambda icerik=msg["content"]: create_pdf(icerik), "Rapor.pdf")
+        if is_bekliyor("analiz_soru"): is_paneli("analiz_soru", sohbet=True)
+        elif (hata := is_sonucu("analiz_soru")) and hata["hata"]: st.error(hata["metin"])
+        elif "analiz_sohbet" in st.session_state: st.caption(st.session_state.analiz_sohbet.usage_caption())
+        if prompt := st.chat_input("Raporla ilgili soru sor...", disabled=is_bekliyor("analiz_soru")):
             st.session_state.analiz_msgs.append({"role": "user", "content": prompt})
-            st.chat_message("user").markdown(prompt)
-            hist = "\n".join([m["content"] for m in st.session_state.analiz_msgs])
-            c = [f"Önceki analiz bağlamında cevap ver: {prompt}\nGeçmiş: {hist}"]
-            if f: 
-                if f.type == "application/pdf": c.append({"mime_type": "application/pdf", "data": f.getvalue()})
-                else: c.append(Image.open(f))
-            res = get_gemini_response(c)
-            st.session_state.analiz_msgs.append({"role": "assistant", "content": res})
-            st.chat_message("assistant").markdown(res)
+            if "analiz_sohbet" not in st.session_state:
+                st.session_state.analiz_sohbet = yeni_sohbet("Daha önce hazırladığın teknik resim raporu bağlamında cevap ver.", st.session_state.analiz_msgs[0]["content"])
+            sohbet_isi("analiz_soru", st.session_state.analiz_sohbet, prompt, "analiz_msgs")
+            st.rerun()
 
 # ==================================================
 # MODÜL 3: STAJ DEFTERİ (SOLA DAYALI + PDF)
@@ -357,7 +2318,10 @@ def sayfa_staj():
     st.markdown("---")
     
     # Kaynak Seçimi (Metin veya Dosya)
-    kaynak = st.radio("Veri Girişi", ["Not Yaz", "Dosya Yükle (Foto/PDF)"], horizontal=True)
+    kaynak = st.radio("Veri Girişi", ["Not Yaz", "Dosya Yükle (Foto/PDF)", "Toplu Defter (çok gün)"], horizontal=True)
+    if kaynak == "Toplu Defter (çok gün)":
+        staj_toplu_arayuzu()
+        return
     
     d = st.date_input("Faaliyet Tarihi")
     t = st.text_input("Yapılan İş / Konu", placeholder="Örn: CNC Operasyonu")
@@ -370,19 +2334,18 @@ def sayfa_staj():
     else:
         not_file = st.file_uploader("Not Dosyası", type=["jpg", "png", "pdf"])
     
-    if st.button("Profesyonel Metne Çevir", type="primary"):
-        with st.spinner("Yapay Zeka düzenliyor..."):
-            prompt = f"Staj notunu teknik dille, edilgen çatıda (yapıldı, edildi) yaz. Tarih: {d}, Konu: {t}."
-            inputs = [prompt]
-            
-            if not_text: inputs[0] += f"\nNotlar: {not_text}"
-            if not_file:
-                if not_file.type == "application/pdf": inputs.append({"mime_type": "application/pdf", "data": not_file.getvalue()})
-                else: inputs.append(Image.open(not_file))
-            
-            res = get_gemini_response(inputs)
-            st.write(res)
-            st.download_button("Sayfayı PDF Olarak İndir", create_pdf(f"{d} - {t}\n\n{res}"), "Staj.pdf")
+    if st.button("Profesyonel Metne Çevir", type="primary", disabled=is_bekliyor("staj")):
+        prompt = f"Staj notunu teknik dille, edilgen çatıda (yapıldı, edildi) yaz. Tarih: {d}, Konu: {t}."
+        inputs = [prompt]
+        
+        if not_text: inputs[0] += f"\nNotlar: {not_text}"
+        if not_file: inputs.append(dosya_girdisi(not_file))
+        
+        model_isi("staj", "metin", inputs, baslik=f"{d} - {t}")
+
+    if is_bekliyor("staj"): is_paneli("staj")
+    elif sonuc := is_sonucu("staj"):
+        if sonuc_goster(sonuc): pdf_indir("Sayfayı PDF Olarak İndir", lambda: create_pdf(f"{sonuc['baslik']}\n\n{sonuc['metin']}"), "Staj.pdf")
 
 # ==================================================
 # MODÜL 4: MÜLAKAT KOÇU
@@ -398,48 +2361,109 @@ def sayfa_mulakat():
     p = c2.text_input("Pozisyon", placeholder="Örn: Üretim Mühendisi")
     cv = c2.file_uploader("CV (PDF)", type=["pdf"])
     
+    sistem = f"Sen {s} ({sec}) firmasında teknik müdürsün ve {p} pozisyonu için mülakat yapıyorsun. Doğal konuş, her seferinde tek soru sor."
     if st.button("Simülasyonu Başlat", type="primary"):
-        st.session_state.mlog = [{"role": "assistant", "content": f"Merhaba. Ben {s} ({sec}) firmasından Teknik Müdürüm. {p} pozisyonu için seninle görüşmek istiyorum."}]
+        acilis = f"Merhaba. Ben {s} ({sec}) firmasından Teknik Müdürüm. {p} pozisyonu için seninle görüşmek istiyorum."
+        st.session_state.mlog = [{"role": "assistant", "content": acilis}]
+        st.session_state.msohbet = yeni_sohbet(sistem, acilis)
         st.rerun()
         
     for m in st.session_state.mlog: st.chat_message(m["role"]).markdown(m["content"])
     
-    if usr := st.chat_input("Cevabınızı buraya yazın..."):
+    if is_bekliyor("mulakat"): is_paneli("mulakat", sohbet=True)
+    elif (hata := is_sonucu("mulakat")) and hata["hata"]: st.error(hata["metin"])
+    elif "msohbet" in st.session_state: st.caption(st.session_state.msohbet.usage_caption())
+    
+    if usr := st.chat_input("Cevabınızı buraya yazın...", disabled=is_bekliyor("mulakat")):
         st.session_state.mlog.append({"role": "user", "content": usr})
-        st.chat_message("user").write(usr)
-        inps = [f"Sen {s} ({sec}) yöneticisisin. Doğal konuş. Geçmiş: {st.session_state.mlog}"]
-        if cv: inps += [{"mime_type": "application/pdf", "data": cv.getvalue()}, "CV Ekte"]
-        
-        with st.spinner("Mülakatçı dinliyor..."):
-            res = get_gemini_response(inps)
-            st.session_state.mlog.append({"role": "assistant", "content": res})
-            st.chat_message("assistant").write(res)
+        if "msohbet" not in st.session_state: st.session_state.msohbet = yeni_sohbet(sistem)
+        sohbet = st.session_state.msohbet
+        # CV yalnızca ilk kez görüldüğünde yüklenir
+        if cv and model_hazir(): sohbet.attach(dosya_girdisi(cv))
+        sohbet_isi("mulakat", sohbet, usr, "mlog")
+        st.rerun()
     
     if len(st.session_state.mlog) > 4:
         st.divider()
-        if st.button("Görüşmeyi Bitir ve Raporla"):
-            with st.spinner("Yapay Zeka performansınızı analiz ediyor..."):
-                rpt = get_gemini_response(f"Mülakatı değerlendir. Puanla. Geçmiş: {st.session_state.mlog}")
-                st.markdown(rpt)
-                st.download_button("Karne PDF", create_pdf(rpt), "Karne.pdf")
+        if st.button("Görüşmeyi Bitir ve Raporla", disabled=is_bekliyor("karne") or is_bekliyor("mulakat")):
+            gecmis = st.session_state.msohbet.transcript() if "msohbet" in st.session_state else st.session_state.mlog
+            model_isi("karne", "metin", f"Mülakatı değerlendir. Puanla. Geçmiş: {gecmis}")
+        if is_bekliyor("karne"): is_paneli("karne")
+        elif sonuc := is_sonucu("karne"):
+            if sonuc_goster(sonuc): pdf_indir("Karne PDF", lambda: create_pdf(sonuc["metin"]), "Karne.pdf")
 
 # ==================================================
 # ANA MENÜ (SOL TARAF)
 # ==================================================
-with st.sidebar:
-    st.header("Mühendislik Asistanı")
-    if not api_key: 
-        api_key = st.text_input("API Anahtarı", type="password")
-        st.caption("Otomatik giriş için secrets.toml kullanın.")
-    else:
-        st.success("Yapay Zeka Bağlantısı Aktif")
+SAYFALAR = {
+    "Ders Çalışma Asistanı": sayfa_ders_asistani,
+    "Teknik Resim Analizi": sayfa_analiz,
+    "Staj Defteri": sayfa_staj,
+    "Mülakat Koçu": sayfa_mulakat,
+}
+
+def main():
+    st.set_page_config(
+        page_title="Mühendislik Asistanı",
+        page_icon="📐",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    # Her yeniden çalıştırma kendi kimliğiyle ölçülür
+    _olcum_yerel.calistirma = os.urandom(4).hex()
+    with olcum("calistirma"):
+        arayuz()
+
+def arayuz():
+    global api_key
+    with olcum("css", bayt=len(CSS)):
+        st.markdown(CSS, unsafe_allow_html=True)
+    # Arka planda biten işler, sayfa çizilmeden önce oturuma bağlanır
+    isleri_topla()
+
+    with st.sidebar:
+        st.header("Mühendislik Asistanı")
+        if ayar("MODEL_ARKA_UC") == "yerel":
+            st.info("Yerel test modeli aktif (ağ kullanılmıyor)")
+        elif not api_key: 
+            api_key = st.text_input("API Anahtarı", type="password")
+            st.caption("Otomatik giriş için secrets.toml kullanın.")
+        else:
+            st.success("Yapay Zeka Bağlantısı Aktif")
+        if not st.session_state.get("calisma_alani"): st.session_state.calisma_alani = calisma_alani()
+        st.text_input("Çalışma Alanı", key="calisma_alani",
+                      help="Dersler bu ada göre kalıcı olarak saklanır; aynı adı giren herkes aynı dersleri görür. "
+                           "Ad sayfa adresinde de durur: adresi yer imine ekleyin ya da adı not alıp buraya yeniden girin.")
+        if st.query_params.get("alan") != st.session_state.calisma_alani: st.query_params["alan"] = st.session_state.calisma_alani
+        st.caption(f"Derslerinize dönmek için: `{st.session_state.calisma_alani}` (ya da bu sayfanın adresi)")
+        ist = yanit_onbellegi().stats
+        st.caption(f"Önbellek: {ist['bellek_isabet'] + ist['disk_isabet']} isabet / {ist['iska']} ıska")
+        gec = gecikme_ozeti()
+        toplam = gec["akis_toplam"] if gec["akis_toplam"] is not None else gec["tam_toplam"]
+        if toplam is not None:
+            st.caption("İlk token: " + (f"{gec['ttft']:.2f} sn" if gec["ttft"] is not None else "-") + f" · Tam yanıt: {toplam:.2f} sn")
+        if _bekleyen(): st.caption(f"⏳ Bu oturumda {len(_bekleyen())} iş sürüyor · sunucuda toplam {is_yoneticisi().active()}")
     
-    st.markdown("---")
-    nav = st.radio("Modüller", ["Ders Çalışma Asistanı", "Teknik Resim Analizi", "Staj Defteri", "Mülakat Koçu"], label_visibility="collapsed")
-    st.markdown("---")
-    if st.button("Oturumu Temizle"): st.session_state.clear(); st.rerun()
+        st.markdown("---")
+        nav = st.radio("Modüller", list(SAYFALAR), label_visibility="collapsed")
+        st.markdown("---")
+        if st.button("Oturumu Temizle"): st.session_state.clear(); st.rerun()
+        tanilama = st.toggle("🩺 Tanılama", key="tanilama", help="Süre, token ve hata ölçümlerini gösterir")
+        tanilama_yeri = st.container()
+
+    sayfa = SAYFALAR[nav]
+    try:
+        with olcum(sayfa.__name__):
+            sayfa()
+    except FileNotFoundError as e:
+        # Sayfa çizilirken kotadan düşen ek: iz yerine ne yapılacağı gösterilir. Oturumdaki
+        # referans geçersiz sayılır, bir sonraki çalıştırmada yüklenen dosyadan yeniden üretilir.
+        st.error(str(e))
+
+    # Panel en sonda çizilir ki bu çalıştırmanın sayfa ölçümü de görünsün
+    if tanilama:
+        with tanilama_yeri: tanilama_paneli()
 
-if nav == "Ders Çalışma Asistanı": sayfa_ders_asistani()
-elif nav == "Teknik Resim Analizi": sayfa_analiz()
-elif nav == "Staj Defteri": sayfa_staj()
-elif nav == "Mülakat Koçu": sayfa_mulakat()
\ No newline at end of file
+# streamlit run altında __main__ olarak çalışır; benchmark gibi araçlar motoru içe aktarabilir
+if __name__ == "__main__":
+    main()
\ No newline at end of file
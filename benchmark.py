@@ -0,0 +1,350 @@
+# ==================================================
+# ÇEVRİMDIŞI ÖLÇÜMLER
+# ==================================================
+# Kullanım:
+#   python benchmark.py pdf --formul 100 1000 5000
+#   python benchmark.py akis --tur 3 --gecikme 0.2
+#   python benchmark.py yuk --oturum 1 2 4 8 16 --sure 20
+#   python benchmark.py dayaniklilik --hata 0.1 --yavas 0.05
+import argparse
+import functools
+import io
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw
+from streamlit.testing.v1 import AppTest
+
+# Motor streamlit çalışma zamanı olmadan içe aktarılır; "No runtime found" gibi uyarılar susturulur
+logging.disable(logging.WARNING)
+import app
+
+
+def olc(fn):
+    baslangic = time.perf_counter()
+    sonuc = fn()
+    return sonuc, time.perf_counter() - baslangic
+
+
+# tracemalloc süreyi bozduğu için bellek ayrı bir geçişte ölçülür
+def tepe_bellek(fn):
+    tracemalloc.start()
+    fn()
+    _, tepe = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return tepe
+
+
+def ornek_formuller(n, onek=""):
+    return [f"{onek}F_{i} = m_{i} · a_{i}    σ = F / A    ΔT = {i % 90} °C    (Soru {i // 3 + 1}, çözüm ğüşıöç)" for i in range(n)]
+
+
+# --- PDF ---
+# eski: tüm defterin her seferinde baştan basılması (önceki create_pdf davranışı)
+# soğuk: blok blok ilk üretim, sıcak: aynı içerik (önbellek), artımlı: bir formül eklendikten sonra
+def bench_pdf(sayilar, blok):
+    print(f"Font: {app.pdf_font_yolu() or 'çekirdek font (Unicode TTF bulunamadı)'}")
+    print(f"{'formül':>8} {'eski sn':>9} {'soğuk sn':>9} {'sıcak ms':>9} {'artımlı sn':>11} {'tepe MB':>8} {'PDF KB':>8}")
+    for n in sayilar:
+        formuller = ornek_formuller(n, f"{n}:")
+        _, eski = olc(lambda: app._render_pdf("\n".join(formuller)))
+        pdf, soguk = olc(lambda: app.create_notebook_pdf(formuller, blok))
+        _, sicak = olc(lambda: app.create_notebook_pdf(formuller, blok))
+        formuller.append(f"{n}:yeni = formül")
+        _, artimli = olc(lambda: app.create_notebook_pdf(formuller, blok))
+        app.pdf_onbellegi.clear()
+        tepe = tepe_bellek(lambda: app.create_notebook_pdf(formuller, blok))
+        print(f"{n:>8} {eski:>9.2f} {soguk:>9.2f} {sicak * 1000:>9.2f} {artimli:>11.2f} {tepe / 2**20:>8.1f} {len(pdf) / 1024:>8.0f}")
+
+
+# --- UYGULAMA AKIŞLARI ---
+# app.py AppTest ile başsız sürülür; model olarak ağ kullanmayan yerel test modeli kullanılır.
+# Her akış önce girdileri hazırlar, sonra ölçülen eylemi (buton/sohbet) döndürür.
+UYGULAMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+DERS = "Ölçüm"
+
+
+def yerel_ortam(gecikme, ilk_token):
+    os.environ.update(MODEL_ARKA_UC="yerel", YEREL_GECIKME_SN=str(gecikme), YEREL_ILK_TOKEN_SN=str(ilk_token))
+    os.environ.setdefault("VERI_DIZINI", tempfile.mkdtemp(prefix="muhendis_olcum_"))
+    # Yerel modelin kotası yok; her denemede jeton alan sınırlayıcı ölçülen süreleri bozmasın
+    os.environ.setdefault("DAKIKA_ISTEK_LIMITI", "0")
+
+
+# Telefon fotoğrafı boyutunda, n'e göre değişen bir "soru kağıdı"
+@functools.lru_cache(maxsize=32)
+def ornek_gorsel(n, genislik=3000, yukseklik=4000):
+    img = Image.new("RGB", (genislik, yukseklik), (235, 232, 225))
+    ciz = ImageDraw.Draw(img)
+    for y in range(300, yukseklik - 300, 60):
+        ciz.line((250, y, genislik - 250 - (y * 7 + n * 13) % 900, y), fill=(40, 40, 40), width=6)
+    ciz.rectangle((250, 150, 250 + (n % 20) * 100, 220), fill=(0, 0, 0))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def yeni_oturum(alan):
+    at = AppTest.from_file(UYGULAMA, default_timeout=120)
+    at.run()
+    at.sidebar.text_input(key="calisma_alani").set_value(alan).run()
+    return at
+
+
+def bul(liste, etiket):
+    return next(w for w in liste if w.label == etiket)
+
+
+def hata_kontrol(at):
+    if at.exception: raise RuntimeError(at.exception[0].value)
+
+
+def isleri_bekle(at, sinir=120):
+    bitis = time.perf_counter() + sinir
+    while "bekleyen_isler" in at.session_state and at.session_state["bekleyen_isler"]:
+        if time.perf_counter() > bitis: raise TimeoutError("iş zamanında bitmedi")
+        time.sleep(0.02)
+        at.run()
+    hata_kontrol(at)
+
+
+def modul(at, ad):
+    at.sidebar.radio[0].set_value(ad).run()
+
+
+def ders_ac(at, arac):
+    modul(at, "Ders Çalışma Asistanı")
+    if DERS in at.radio(key="nav_radio").options:
+        at.radio(key="nav_radio").set_value(DERS).run()
+    else:
+        bul(at.text_input, "Ders Adı").set_value(DERS).run()
+        bul(at.button, "Dersi Ekle ve Git").click().run()
+    at.radio(key=f"rad_{DERS}").set_value(arac).run()
+
+
+def akis_coz(at, n):
+    ders_ac(at, "Soru Çözücü")
+    at.file_uploader(key=f"up_{DERS}").set_value(("soru.jpg", ornek_gorsel(n), "image/jpeg"))
+    bul(at.text_input, "Hangi soruyu çözeyim?").set_value(f"Soru {n}").run()
+    return lambda: at.button(key=f"solve_{DERS}").click().run()
+
+
+def akis_ozet(at, n):
+    ders_ac(at, "Konu Özeti")
+    bul(at.text_input, "Konu Başlığı").set_value(f"Konu {n}").run()
+    return lambda: at.button(key=f"ozet_btn_{DERS}").click().run()
+
+
+def akis_sinav(at, n):
+    ders_ac(at, "Örnek Sınav")
+    return lambda: at.button(key=f"ex_{DERS}").click().run()
+
+
+def akis_analiz(at, n):
+    modul(at, "Teknik Resim Analizi")
+    at.file_uploader[0].set_value(("cizim.jpg", ornek_gorsel(n), "image/jpeg")).run()
+    return lambda: bul(at.button, "Analizi Başlat").click().run()
+
+
+def akis_staj(at, n):
+    modul(at, "Staj Defteri")
+    bul(at.text_input, "Yapılan İş / Konu").set_value(f"Tezgah bakımı {n}")
+    bul(at.text_area, "Ham Notlar").set_value("Bugün usta ile tezgah bakımı yaptık.").run()
+    return lambda: bul(at.button, "Profesyonel Metne Çevir").click().run()
+
+
+def akis_mulakat(at, n):
+    modul(at, "Mülakat Koçu")
+    if not at.session_state["mlog"]: bul(at.button, "Simülasyonu Başlat").click().run()
+    return lambda: at.chat_input[0].set_value(f"Cevabım {n}: tolerans analizi yaptım.").run()
+
+
+AKISLAR = {
+    "coz": akis_coz,
+    "ozet": akis_ozet,
+    "sinav": akis_sinav,
+    "analiz": akis_analiz,
+    "staj": akis_staj,
+    "mulakat": akis_mulakat,
+}
+
+
+# Eylemden sonucun oturuma bağlanmasına kadar geçen süre
+def akis_calistir(at, ad, n):
+    eylem = AKISLAR[ad](at, n)
+    hata_kontrol(at)
+    _, sure = olc(lambda: (eylem(), isleri_bekle(at)))
+    return sure
+
+
+def yeniden_calistirma(at, tekrar=3):
+    return sorted(olc(at.run)[1] for _ in range(tekrar))[tekrar // 2]
+
+
+def onbellek_durumu(at):
+    at.run()
+    for c in at.sidebar.caption:
+        m = re.match(r"Önbellek: (\d+) isabet / (\d+) ıska", c.value)
+        if m: return int(m.group(1)), int(m.group(2))
+    return 0, 0
+
+
+def bench_akis(tur, oturum_sayisi):
+    print(f"{'akış':>8} {'uçtan uca ms':>13} {'yeniden çalıştırma ms':>22}")
+    at = yeni_oturum("olcum_akis")
+    sureler = {ad: [] for ad in AKISLAR}
+    yeniden = {ad: [] for ad in AKISLAR}
+    for t in range(tur):
+        for ad in AKISLAR:
+            sureler[ad].append(akis_calistir(at, ad, t))
+            yeniden[ad].append(yeniden_calistirma(at))
+    for ad in AKISLAR:
+        print(f"{ad:>8} {app.yuzdelik(sureler[ad], 50) * 1000:>13.1f} {app.yuzdelik(yeniden[ad], 50) * 1000:>22.1f}")
+
+    # Aynı girdilerle ikinci tur: sohbet ve sınav geçmişe bağlı olduğundan ıska sayılır
+    isabet0, iska0 = onbellek_durumu(at)
+    for ad in AKISLAR: akis_calistir(at, ad, 0)
+    isabet, iska = onbellek_durumu(at)
+    isabet, iska = isabet - isabet0, iska - iska0
+    print(f"Önbellek (aynı girdilerle tekrar): {isabet} isabet / {iska} ıska · %{100 * isabet / max(isabet + iska, 1):.0f}")
+
+    # Oturum başına kalıcı bellek: ortak önbellekler ısındıktan sonra açık tutulan oturumların farkı
+    tracemalloc.start()
+    once, _ = tracemalloc.get_traced_memory()
+    oturumlar = []
+    for i in range(oturum_sayisi):
+        yeni = yeni_oturum(f"olcum_bellek_{i}")
+        for ad in AKISLAR: akis_calistir(yeni, ad, 0)
+        oturumlar.append(yeni)
+    sonra, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"Oturum başına bellek: {(sonra - once) / oturum_sayisi / 2**20:.1f} MB ({oturum_sayisi} oturum, tüm akışlar)")
+
+    metinler = [f"Rapor {i}\n" + "\n".join(ornek_formuller(60, f"{i}:")) for i in range(20)]
+    _, sure = olc(lambda: [app.create_pdf(m) for m in metinler])
+    print(f"PDF üretimi: {len(metinler) / sure:.1f} belge/sn ({sum(map(len, metinler)) // len(metinler)} karakter/belge)")
+
+
+# --- YÜK TESTİ ---
+# N oturum aynı süreçte eşzamanlı olarak akışları döngüyle çalıştırır; girdiler her turda
+# değiştiği için önbellek yardımı olmaz. Oturum sayısı arttıkça akış/dk artışının durduğu nokta
+# tek sürecin doyduğu yerdir.
+# AppTest her çalıştırmada süreç genelindeki Runtime örneğini değiştirdiği için eşzamanlı
+# oturumların script çalıştırmaları sıraya alınır. GIL altında gerçek sunucuda da script'lerin
+# CPU işi fiilen sıralıdır; model işleri arka plan havuzunda paralel kalır.
+def appteste_kilit():
+    kilit = threading.Lock()
+    asil = AppTest._run
+    def kilitli(self, *args, **kwargs):
+        with kilit: return asil(self, *args, **kwargs)
+    AppTest._run = kilitli
+
+
+def yuk_oturumu(i, n_oturum, bitis, sonuc):
+    try:
+        at = yeni_oturum(f"olcum_yuk_{n_oturum}_{i}")
+        n = 0
+        while time.perf_counter() < bitis:
+            for ad in AKISLAR:
+                if time.perf_counter() >= bitis: break
+                n += 1
+                sure = akis_calistir(at, ad, i * 100000 + n)
+                sonuc["akis"].append(sure)
+                sonuc["yeniden"].append(olc(at.run)[1])
+    except Exception as e:
+        sonuc["hata"].append(type(e).__name__)
+
+
+def bench_yuk(oturumlar, sure):
+    appteste_kilit()
+    print(f"{'oturum':>7} {'akış/dk':>9} {'p50 ms':>9} {'p95 ms':>9} {'yeniden p95 ms':>15} {'hata':>5}")
+    onceki = None
+    for n in oturumlar:
+        sonuc = {"akis": [], "yeniden": [], "hata": []}
+        bitis = time.perf_counter() + sure
+        baslangic = time.perf_counter()
+        iplikler = [threading.Thread(target=yuk_oturumu, args=(i, n, bitis, sonuc)) for i in range(n)]
+        for t in iplikler: t.start()
+        for t in iplikler: t.join()
+        gecen = time.perf_counter() - baslangic
+        hiz = len(sonuc["akis"]) / gecen * 60
+        p = lambda liste, y: (app.yuzdelik(liste, y) or 0) * 1000
+        not_ = "  ← doyma" if onceki and hiz < onceki * 1.1 else ""
+        print(f"{n:>7} {hiz:>9.1f} {p(sonuc['akis'], 50):>9.0f} {p(sonuc['akis'], 95):>9.0f} {p(sonuc['yeniden'], 95):>15.0f} {len(sonuc['hata']):>5}{not_}")
+        onceki = hiz
+
+
+# --- DAYANIKLI ÇAĞRI ---
+# Hata ve yavaş kuyruk enjekte eden yerel modele karşı çağrı katmanının politikaları karşılaştırılır.
+# Süre, akışın ilk parçasına kadar ölçülür (kullanıcının beklediği süre).
+def bench_dayaniklilik(istek, eszamanli, hata, yavas, gecikme):
+    arka = app.LocalBackend(gecikme, gecikme / 4, fault_rate=hata, slow_rate=yavas, slow_factor=10)
+    politikalar = {
+        "düz": dict(attempts=1, hedge_percentile=0),
+        "yeniden": dict(attempts=3, hedge_percentile=0),
+        "yeniden+hedge": dict(attempts=3, hedge_percentile=90),
+    }
+    print(f"hata %{hata * 100:.0f} · yavaş %{yavas * 100:.0f} (×10) · {istek} istek · {eszamanli} eşzamanlı")
+    print(f"{'politika':>14} {'başarı %':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'hedge':>6} {'ort. deneme':>12}")
+    for ad, secenekler in politikalar.items():
+        cagri = app.ResilientCaller(arka, ["yerel"], deadline=gecikme * 30, backoff=gecikme / 4,
+                                    breaker_threshold=10**6, workers=eszamanli * 2, **secenekler)
+
+        def tek(i):
+            usage = {}
+            baslangic = time.perf_counter()
+            ilk = None
+            try:
+                for _ in cagri.stream([f"istek {i}"], usage):
+                    if ilk is None: ilk = time.perf_counter() - baslangic
+            except Exception:
+                return None, usage
+            return ilk, usage
+
+        with ThreadPoolExecutor(max_workers=eszamanli) as havuz:
+            sonuclar = list(havuz.map(tek, range(istek)))
+        sureler = [s for s, _ in sonuclar if s is not None]
+        p = lambda y: (app.yuzdelik(sureler, y) or 0) * 1000
+        hedge = sum(1 for _, u in sonuclar if u.get("hedge"))
+        deneme = sum(u.get("deneme", 0) for s, u in sonuclar if s is not None) / max(len(sureler), 1)
+        print(f"{ad:>14} {100 * len(sureler) / istek:>9.1f} {p(50):>8.0f} {p(95):>8.0f} {p(99):>8.0f} {hedge:>6} {deneme:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mühendislik Asistanı çevrimdışı ölçümleri")
+    alt = parser.add_subparsers(dest="komut", required=True)
+    p_pdf = alt.add_parser("pdf", help="formül defteri PDF üretim süresi ve belleği")
+    p_pdf.add_argument("--formul", type=int, nargs="+", default=[100, 1000, 5000])
+    p_pdf.add_argument("--blok", type=int, default=500)
+    p_akis = alt.add_parser("akis", help="modül akışlarının uçtan uca ve yeniden çalıştırma süreleri, bellek, önbellek")
+    p_akis.add_argument("--tur", type=int, default=3)
+    p_akis.add_argument("--oturum", type=int, default=3, help="bellek ölçümünde açık tutulan oturum sayısı")
+    p_yuk = alt.add_parser("yuk", help="N eşzamanlı oturumla doyma noktası")
+    p_yuk.add_argument("--oturum", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    p_yuk.add_argument("--sure", type=float, default=20, help="her oturum sayısı için saniye")
+    p_day = alt.add_parser("dayaniklilik", help="hata enjekte eden yerel modelle yeniden deneme/hedge karşılaştırması")
+    p_day.add_argument("--istek", type=int, default=400)
+    p_day.add_argument("--eszamanli", type=int, default=16)
+    p_day.add_argument("--hata", type=float, default=0.1, help="geçici hata oranı (0-1)")
+    p_day.add_argument("--yavas", type=float, default=0.05, help="yavaş kuyruk oranı (0-1)")
+    p_day.add_argument("--gecikme", type=float, default=0.2)
+    for p in (p_akis, p_yuk):
+        p.add_argument("--gecikme", type=float, default=0.2, help="yerel modelin yanıt süresi (sn)")
+        p.add_argument("--ilk-token", type=float, default=0.05)
+    args = parser.parse_args()
+    if args.komut == "pdf":
+        bench_pdf(args.formul, args.blok)
+    elif args.komut == "akis":
+        yerel_ortam(args.gecikme, args.ilk_token)
+        bench_akis(args.tur, args.oturum)
+    elif args.komut == "dayaniklilik":
+        bench_dayaniklilik(args.istek, args.eszamanli, args.hata, args.yavas, args.gecikme)
+    elif args.komut == "yuk":
+        yerel_ortam(args.gecikme, args.ilk_token)
+        bench_yuk(args.oturum, args.sure)
\ No newline at end of file
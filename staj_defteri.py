@@ -0,0 +1,59 @@
+# ==================================================
+# TOPLU STAJ DEFTERİ (ARAYÜZSÜZ)
+# ==================================================
+# Bir klasördeki (veya verilen) tarihli günlük notları paralel çevirip tek, tarih sıralı PDF üretir.
+# Tarih dosya adından okunur: 2025-07-14_cnc.txt, 20250715.jpg, 16.07.2025 kaynak.pdf
+# Kullanım:
+#   python staj_defteri.py notlar/ -o Staj_Defteri.pdf
+#   MODEL_ARKA_UC=yerel python staj_defteri.py notlar/*.txt
+import argparse
+import logging
+import os
+import sys
+import time
+
+# Arayüzsüz çalışmada bekleyen etkileşimli kullanıcı yok: toplu havuz ve istek payı tam kullanılır
+os.environ.setdefault("TOPLU_ISCI", "8")
+os.environ.setdefault("TOPLU_KOTA_ORANI", "1.0")
+
+# Motor streamlit çalışma zamanı olmadan içe aktarılır; "No runtime found" gibi uyarılar susturulur
+logging.disable(logging.WARNING)
+import app
+
+
+def not_dosyalari(yollar):
+    for yol in yollar:
+        if os.path.isdir(yol):
+            yield from not_dosyalari(sorted(os.path.join(yol, ad) for ad in os.listdir(yol) if not ad.startswith(".")))
+        elif yol.lower().endswith(app.NOT_UZANTILARI):
+            yield yol
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Tarihli günlük notlardan tek PDF staj defteri üretir")
+    ap.add_argument("kaynak", nargs="+", help="not klasörü ya da dosyaları (.txt .md .jpg .png .pdf)")
+    ap.add_argument("-o", "--cikti", default="Staj_Defteri.pdf")
+    args = ap.parse_args()
+
+    if not app.model_hazir():
+        sys.exit("API anahtarı eksik: GEMINI_API_KEY ya da MODEL_ARKA_UC=yerel verin.")
+    notlar = []
+    for yol in not_dosyalari(args.kaynak):
+        with open(yol, "rb") as f: notlar.append((os.path.basename(yol), app.not_parcasi(yol, f.read())))
+    gunler, tarihsiz = app.staj_gunleri(notlar)
+    for ad in tarihsiz: print(f"atlandı (tarih yok): {ad}", file=sys.stderr)
+    if not gunler: sys.exit("Tarihli not bulunamadı.")
+
+    baslangic = time.perf_counter()
+    sayfalar = app.staj_defteri(gunler, lambda biten, toplam: print(f"\r{biten}/{toplam} gün", end="", file=sys.stderr, flush=True))
+    print(file=sys.stderr)
+    hatali = [s for s in sayfalar if s["hata"]]
+    for s in hatali: print(f"yazılamadı: {s['baslik']}: {s['metin']}", file=sys.stderr)
+    if len(hatali) < len(sayfalar):
+        with open(args.cikti, "wb") as f: f.write(app.create_pdf(app.defter_metni(sayfalar)))
+        print(f"{args.cikti}: {len(sayfalar) - len(hatali)} gün · {time.perf_counter() - baslangic:.1f} sn")
+    sys.exit(1 if hatali else 0)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,4 @@
+import os, sys
+
+# app.py depo kökünde tek modül; testler `pytest` ile de doğrudan çalışsın
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
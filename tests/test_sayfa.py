@@ -0,0 +1,31 @@
+import pytest
+
+from app import parse_page_refs
+
+# Soru metninden PDF sayfa seçimi için gerileme tablosu: (metin, belge sayfa sayısı, beklenen)
+ORNEKLER = [
+    ("Sayfa 3, Soru 5", 10, [3]),
+    ("sayfa 2-4", 10, [2, 3, 4]),
+    ("s. 7 ve 9", 10, [7, 9]),
+    ("3. sayfadaki 2. soru", 10, [3]),
+    ("Sayfa 3, 15. soru", 20, [3]),
+    ("sayfa 3, 5 ve 15. soru", 20, [3, 5]),
+    ("Soru 12 sayfa 3", 20, [3]),
+    ("soru 4, 6 sayfa", 20, [6]),
+    ("2. ve 3. sayfa", 10, [2, 3]),
+    ("1., 2. ve 4. sayfadaki sorular", 10, [1, 2, 4]),
+    ("60 sayfalık föyün 3. sorusu", 80, []),
+    ("60 sayfalık föyün 5. sayfası", 80, [5]),
+    ("sayfa 1-5000000", 12, list(range(1, 13))),
+    ("sayfa 40", 12, []),
+    ("", 10, []),
+]
+
+
+@pytest.mark.parametrize("metin, toplam, beklenen", ORNEKLER)
+def test_sayfa_secimi(metin, toplam, beklenen):
+    assert parse_page_refs(metin, toplam) == beklenen
+
+
+def test_bilinmeyen_boyutta_aralik_kirpilir():
+    assert len(parse_page_refs("sayfa 1-5000000")) == 1000